@@ -0,0 +1,124 @@
+"""Microbenchmarks of the per request crypto overhead.
+
+Compares the previous string based implementation of the request
+envelope with tuya_sharing.crypto.
+
+Usage:
+    python benchmarks/bench_crypto.py [iterations]
+"""
+import base64
+import hashlib
+import hmac
+import json
+import random
+import sys
+import timeit
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from tuya_sharing import crypto
+
+PARAMS = {"homeId": "12345678"}
+BODY = {"commands": [{"code": "switch_led", "value": True}, {"code": "bright_value", "value": 500}]}
+RESPONSE = json.dumps({"result": [{"id": "bf0123456789abcdef", "status": [{"code": "switch", "value": True}]}] * 20})
+REFRESH_TOKEN = "0123456789abcdef0123456789abcdef"
+
+
+# previous implementation
+
+def _random_nonce(e=32):
+    t = "ABCDEFGHJKMNPQRSTWXYZabcdefhijkmnprstwxyz2345678"
+    a = len(t)
+    n = ""
+    for i in range(e):
+        n += t[random.randint(0, a - 1)]
+    return n
+
+
+def _aes_gcm_encrypt(raw_data, secret):
+    nonce = _random_nonce(12)
+    raw_data = raw_data.encode('utf-8')
+    secret = secret.encode('utf-8')
+    nonce = nonce.encode('utf-8')
+    cipher = AESGCM(secret)
+    ciphertext = cipher.encrypt(nonce, raw_data, None)
+    return base64.b64encode(nonce) + base64.b64encode(ciphertext)
+
+
+def _aex_gcm_decrypt(cipher_data, secret):
+    cipher_data = base64.b64decode(cipher_data)
+    nonce = cipher_data[:12]
+    cipher_text = cipher_data[12:]
+    secret = secret.encode('utf-8')
+    cipher = AESGCM(secret)
+    decrypt = cipher.decrypt(nonce, cipher_text, None)
+    return str(decrypt, encoding="utf8")
+
+
+def _secret_generating(rid, sid, hash_key):
+    checksum = hmac.new(rid.encode('utf-8'), hash_key.encode('utf-8'), hashlib.sha256)
+    return checksum.digest().hex()[:16]
+
+
+def _restful_sign(hash_key, query_encdata, body_encdata, data):
+    header_sign_str = ""
+    for item in ["X-appKey", "X-requestId", "X-sid", "X-time", "X-token"]:
+        val = data.get(item, "")
+        if val != "":
+            header_sign_str += item + "=" + val + "||"
+    sign_str = header_sign_str[:-2] + query_encdata + body_encdata
+    return hmac.new(bytes(hash_key, 'utf-8'), bytes(sign_str, 'utf-8'), hashlib.sha256).hexdigest()
+
+
+def before(headers, encrypted_response):
+    rid = headers["X-requestId"]
+    md5 = hashlib.md5()
+    md5.update((rid + REFRESH_TOKEN).encode('utf-8'))
+    hash_key = md5.hexdigest()
+    secret = _secret_generating(rid, "", hash_key)
+    query = str(_aes_gcm_encrypt(json.dumps(PARAMS, separators=(',', ':')), secret), encoding="utf8")
+    body = str(_aes_gcm_encrypt(json.dumps(BODY, separators=(',', ':')), secret), encoding="utf8")
+    _restful_sign(hash_key, query, body, headers)
+    return _aex_gcm_decrypt(encrypted_response[secret], secret)
+
+
+def after(headers, encrypted_response):
+    rid = headers["X-requestId"]
+    key = crypto.hash_key(rid, REFRESH_TOKEN)
+    secret = crypto.generate_secret(rid, "", key)
+    cipher = crypto.RequestCipher(secret)
+    query = cipher.encrypt(json.dumps(PARAMS, separators=(',', ':')).encode("utf-8"))
+    body = cipher.encrypt(json.dumps(BODY, separators=(',', ':')).encode("utf-8"))
+    crypto.restful_sign(key, query, body, headers)
+    return cipher.decrypt(encrypted_response[secret.decode("utf-8")])
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    headers = {"X-appKey": "appkey", "X-requestId": str(uuid.uuid4()), "X-sid": "", "X-time": "1700000000000",
+               "X-token": "token"}
+
+    # the server encrypts the response as base64(nonce + ciphertext)
+    secret = _secret_generating(headers["X-requestId"], "", hashlib.md5(
+        (headers["X-requestId"] + REFRESH_TOKEN).encode('utf-8')).hexdigest())
+    nonce = crypto.random_nonce()
+    encrypted_response = {
+        secret: base64.b64encode(nonce + AESGCM(secret.encode("utf-8")).encrypt(nonce, RESPONSE.encode("utf-8"), None))
+    }
+
+    assert before(headers, encrypted_response) == after(headers, encrypted_response).decode("utf-8")
+
+    cases = (
+        ("nonce", lambda: _random_nonce(12), crypto.random_nonce),
+        ("request", lambda: before(headers, encrypted_response), lambda: after(headers, encrypted_response)),
+    )
+    for name, old_func, new_func in cases:
+        old = timeit.timeit(old_func, number=iterations)
+        new = timeit.timeit(new_func, number=iterations)
+        print(f"{name:8s} before {old / iterations * 1e6:8.2f} us  after {new / iterations * 1e6:8.2f} us  "
+              f"x{old / new:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,7 @@ setup(
     ],
     version=__version__,
     install_requires=requirements(),
+    extras_require={"async": ["aiohttp"], "fast": ["orjson"]},
     test_suite="runtests.runtests",
     entry_points={"nose.plugins": []},
     packages=find_packages(),
@@ -1,9 +1,13 @@
 from .version import VERSION
-from .manager import Manager, SharingDeviceListener
+from .manager import DeviceDiff, Manager, SharingDeviceListener
 from .customerlogging import logger
 from .device import CustomerDevice, DeviceFunction, DeviceStatusRange
-from .scenes import SharingScene, SceneRepository
+from .cache import ProductCache, StaleWhileRevalidateCache
+from .scenes import SharingScene, SceneRepository, AsyncSceneRepository
 from .customerapi import CustomerApi, SharingTokenListener
+from .async_customerapi import AsyncCustomerApi
+from .deadline import DeadlineExceeded, deadline
+from .retry import CircuitBreakers, CircuitOpenError, RetryPolicy
 from .user import LoginControl, UserRepository
 from .strategy import strategy
 from . import strategy_repo
@@ -11,16 +15,26 @@ from . import strategy_repo
 
 __all__ = [
     "Manager",
+    "DeviceDiff",
     "logger",
     "CustomerDevice",
     "DeviceFunction",
     "DeviceStatusRange",
+    "ProductCache",
+    "StaleWhileRevalidateCache",
     "SharingScene",
     "CustomerApi",
+    "AsyncCustomerApi",
+    "DeadlineExceeded",
+    "deadline",
+    "RetryPolicy",
+    "CircuitBreakers",
+    "CircuitOpenError",
     "SharingDeviceListener",
     "SharingTokenListener",
     "LoginControl",
     "SceneRepository",
+    "AsyncSceneRepository",
     "UserRepository",
     "strategy"
 ]
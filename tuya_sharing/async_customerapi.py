@@ -0,0 +1,300 @@
+"""Asynchronous Customer API."""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any
+
+from . import codec
+from .customerapi import (
+    DEFAULT_TIMEOUT,
+    CustomerTokenInfo,
+    SharingTokenListener,
+    _deadline_exceeded,
+    _decrypt_response,
+    _encrypt_request,
+    _request_key,
+    _request_timeout,
+)
+from .customerlogging import logger
+from .retry import CircuitBreakers, CircuitOpenError, RetryPolicy
+
+
+def _client_timeout(timeout: float | tuple[float, float]):
+    import aiohttp
+
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return aiohttp.ClientTimeout(total=connect + read, sock_connect=connect, sock_read=read)
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+class AsyncCustomerApi:
+    """Customer API for asyncio hosts.
+
+    Uses the same signing and AES-GCM envelope as CustomerApi, on top of a
+    pooled aiohttp session, so many requests can be in flight at once.
+    aiohttp is only imported when the first request is made. Retries and
+    circuit breaking work as in CustomerApi, and so does coalescing of
+    identical GET requests.
+    """
+
+    def __init__(
+            self,
+            token_info: CustomerTokenInfo,
+            client_id: str,
+            user_code: str,
+            end_point: str,
+            listener: SharingTokenListener = None,
+            session: Any = None,
+            limit: int = 100,
+            limit_per_host: int = 0,
+            keepalive_timeout: float = 15,
+            timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+            retry_policy: RetryPolicy = None,
+            circuit_breakers: CircuitBreakers = None,
+            coalesce_gets: bool = False,
+    ):
+        self.session = session
+        self.timeout = timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breakers = circuit_breakers if circuit_breakers is not None else CircuitBreakers()
+        self.token_info = token_info
+        self.client_id = client_id
+        self.user_code = user_code
+        self.endpoint = end_point
+        self.token_listener = listener
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._own_session = session is None
+        self._refresh_lock: asyncio.Lock | None = None
+        self.coalesce_gets = coalesce_gets
+        self.coalesced_gets = 0
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    def _get_session(self):
+        if self.session is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=self.keepalive_timeout
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def __request(
+            self,
+            method: str,
+            path: str,
+            params: dict[str, Any] | None = None,
+            body: dict[str, Any] | None = None,
+            refresh_token: bool = True,
+            timeout: float | tuple[float, float] | None = None,
+    ) -> dict[str, Any] | None:
+
+        if refresh_token:
+            await self.refresh_access_token_if_need()
+
+        import aiohttp
+
+        session = self._get_session()
+        breaker = self.circuit_breakers.get(path)
+        attempt = 0
+        while True:
+            attempt += 1
+            request_timeout = _request_timeout(self.timeout if timeout is None else timeout)
+            if not breaker.allow():
+                raise CircuitOpenError(f"circuit of {breaker.name} is open")
+
+            try:
+                cipher, request_params, request_body, headers = _encrypt_request(
+                    self.token_info, self.client_id, params, body
+                )
+                async with session.request(
+                        method, self.endpoint + path, params=request_params, json=request_body, headers=headers,
+                        timeout=_client_timeout(request_timeout)
+                ) as response:
+                    status = response.status
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                delay = None
+                if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                    delay = self.retry_policy.next_delay(method, attempt)
+                if delay is None:
+                    raise
+                logger.debug(f"retry {method} {path} in {delay:.2f}s after {e!r}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # cancelled or failed without an outcome, do not keep a half open circuit waiting for this trial
+                breaker.release()
+                raise
+
+            if status >= 400:
+                if self.retry_policy.is_retryable_status(status):
+                    breaker.record_failure()
+                    delay = self.retry_policy.next_delay(method, attempt)
+                    if delay is not None:
+                        logger.debug(f"retry {method} {path} in {delay:.2f}s after status {status}")
+                        await asyncio.sleep(delay)
+                        continue
+                else:
+                    breaker.record_success()
+                logger.error(
+                    f"Response error: code={status}, content={content}"
+                )
+                return None
+
+            breaker.record_success()
+            return _decrypt_response(codec.loads(content), cipher)
+
+    async def refresh_access_token_if_need(self):
+        if not self._token_need_refresh():
+            return
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            # another task may have refreshed while we were waiting
+            if not self._token_need_refresh():
+                return
+            try:
+                response = await self.__request(
+                    "GET", "/v1.0/m/token/" + self.token_info.refresh_token, refresh_token=False
+                )
+
+                if response and response.get("success"):
+                    result = response.get("result", {})
+                    token_info = {
+                        "t": response["t"],
+                        "expire_time": result["expireTime"],
+                        "uid": result["uid"],
+                        "access_token": result["accessToken"],
+                        "refresh_token": result["refreshToken"]
+                    }
+                    self.token_info = CustomerTokenInfo(token_info)
+                    if self.token_listener is not None:
+                        self.token_listener.update_token(token_info)
+            except Exception as e:
+                logger.error("net work error = %s", e)
+
+    def _token_need_refresh(self) -> bool:
+        now = int(time.time() * 1000)
+        return self.token_info.expire_time - 60 * 1000 <= now  # 1min
+
+    async def get(self, path: str, params: dict[str, Any] | None = None,
+                  timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
+        """Http Get.
+
+        Args:
+            path (str): api path
+            params (map): request parameter
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
+
+        Returns:
+            response: response body
+        """
+        if not self.coalesce_gets:
+            return await self.__request("GET", path, params, None, timeout=timeout)
+
+        # calls with another timeout do not share a request, it would not be theirs
+        key = _request_key(path, params, timeout)
+        while True:
+            task = self._in_flight.get(key)
+            leader = task is None
+            if leader:
+                task = asyncio.ensure_future(self.__coalesced_get(path, params, timeout))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda done: self._on_get_done(key, done))
+            else:
+                self.coalesced_gets += 1
+            try:
+                # a cancelled caller must not cancel the request the others wait for
+                return await asyncio.shield(task)
+            except _LeaderDeadlineExceeded as e:
+                if leader:
+                    raise e.error from None
+                # a leader that ran out of its own deadline says nothing about ours, send it again
+
+    async def __coalesced_get(self, path: str, params: dict[str, Any] | None,
+                              timeout: float | tuple[float, float] | None) -> dict[str, Any]:
+        try:
+            return await self.__request("GET", path, params, None, timeout=timeout)
+        except Exception as e:
+            # runs in the context of the leader, with its deadline
+            if _deadline_exceeded(e):
+                raise _LeaderDeadlineExceeded(e) from e
+            raise
+
+    def _on_get_done(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # mark the error as retrieved even if every caller was cancelled
+            task.exception()
+
+    async def post(self, path: str, params: dict[str, Any] | None = None, body: dict[str, Any] | None = None,
+                   timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
+        """Http Post.
+
+        Args:
+            path (str): api path
+            params (map): request parameter
+            body (map): request body
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("POST", path, params, body, timeout=timeout)
+
+    async def put(self, path: str, body: dict[str, Any] | None = None,
+                  timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
+        """Http Put.
+
+        Args:
+            path (str): api path
+            body (map): request body
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("PUT", path, None, body, timeout=timeout)
+
+    async def delete(self, path: str, params: dict[str, Any] | None = None,
+                     timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
+        """Http Delete.
+
+        Args:
+            path (str): api path
+            params (map): request param
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
+
+        Returns:
+            response: response body
+        """
+        return await self.__request("DELETE", path, params, None, timeout=timeout)
+
+    async def close(self):
+        """Close the underlying session if it was created by this client."""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+        self.session = None
+
+    async def __aenter__(self) -> AsyncCustomerApi:
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class _LeaderDeadlineExceeded(Exception):
+    """A coalesced GET failed because the deadline of the caller that sent it ran out."""
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
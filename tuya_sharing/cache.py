@@ -0,0 +1,246 @@
+"""Local caches for cloud data."""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from . import codec
+from .customerlogging import logger
+
+PRODUCT_CACHE_VERSION = 1
+
+
+class TTLCache:
+    """Thread safe in memory cache whose entries expire after ttl seconds.
+
+    Entries are stamped with wall clock time so that they can be persisted
+    and still expire correctly after a restart.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_time, value = entry
+            if time.time() - stored_time >= self.ttl:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any, stored_time: float = None):
+        with self._lock:
+            self._entries[key] = (time.time() if stored_time is None else stored_time, value)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self) -> list[tuple[str, tuple[float, Any]]]:
+        with self._lock:
+            return list(self._entries.items())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ProductCache:
+    """Product keyed cache of device specifications and DP strategy info.
+
+    Devices of the same product share their specification and status
+    strategy, so the results of `/v1.1/m/life/{id}/specifications` and
+    `/v1.0/m/life/devices/{id}/status` only need to be fetched once per product.
+
+    Args:
+        ttl(float): seconds an entry stays valid
+        path(str): optional json file the cache is loaded from and saved to
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, path: str = None):
+        self.path = path
+        self._specifications = TTLCache(ttl)
+        self._strategies = TTLCache(ttl)
+        self._dirty = False
+        # bootstrap and the bind scheduler may save at the same time, they share the temp file
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    def get_specification(self, product_id: str) -> Optional[dict[str, Any]]:
+        return self._count(self._specifications.get(product_id))
+
+    def set_specification(self, product_id: str, result: dict[str, Any]):
+        self._specifications.set(product_id, result)
+        self._dirty = True
+
+    def get_strategy(self, product_id: str) -> Optional[dict[str, Any]]:
+        return self._count(self._strategies.get(product_id))
+
+    def set_strategy(self, product_id: str, result: dict[str, Any]):
+        self._strategies.set(product_id, result)
+        self._dirty = True
+
+    def invalidate(self, product_id: str = None):
+        """Drop one product, or every product when product_id is None."""
+        if product_id is None:
+            self._specifications.clear()
+            self._strategies.clear()
+        else:
+            self._specifications.delete(product_id)
+            self._strategies.delete(product_id)
+        self._dirty = True
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def load(self):
+        """Load cached products from path, ignoring a missing or outdated file."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as fileobj:
+                data = codec.loads(fileobj.read())
+            if data.get("version") != PRODUCT_CACHE_VERSION:
+                logger.debug(f"product cache version mismatch, ignore {self.path}")
+                return
+            for product_id, (stored_time, value) in data.get("specifications", {}).items():
+                self._specifications.set(product_id, value, stored_time)
+            for product_id, (stored_time, value) in data.get("strategies", {}).items():
+                self._strategies.set(product_id, value, stored_time)
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            # a malformed file is ignored as a whole
+            self._specifications.clear()
+            self._strategies.clear()
+            logger.error("load product cache error = %s", e)
+
+    def save(self):
+        """Persist the cache to path if anything changed since the last save."""
+        if self.path is None:
+            return
+        with self._save_lock:
+            if not self._dirty:
+                return
+            # cleared first, so that an entry set while saving is saved next time
+            self._dirty = False
+            data = {
+                "version": PRODUCT_CACHE_VERSION,
+                "specifications": dict(self._specifications.items()),
+                "strategies": dict(self._strategies.items()),
+            }
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as fileobj:
+                    fileobj.write(codec.dumps(data))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                self._dirty = True
+                logger.error("save product cache error = %s", e)
+
+
+class StaleWhileRevalidateCache:
+    """Serve cached values at once and refresh them in the background once stale.
+
+    A value is fresh for ttl seconds. After that it is still served, for at
+    most max_stale more seconds when set, while a background thread loads a
+    new one. Missing and expired values are loaded by the caller. Loaders
+    return None on failure, which is never cached.
+
+    Args:
+        ttl(float): seconds a value is fresh
+        max_stale(float): seconds a stale value may be served, None for no limit
+    """
+
+    def __init__(self, ttl: float = 60, max_stale: Optional[float] = None):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._versions: dict[str, int] = {}
+        self._generation = 0
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, key: str, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        with self._lock:
+            version = self._version(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_time, value = entry
+                age = time.monotonic() - stored_time
+                if age < self.ttl:
+                    self.hits += 1
+                    return value
+                if self.max_stale is None or age < self.ttl + self.max_stale:
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(
+                            target=self._refresh, args=(key, loader, version), name="tuya-sharing-revalidate",
+                            daemon=True
+                        ).start()
+                    return value
+            self.misses += 1
+
+        value = loader()
+        self._store(key, value, version)
+        return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+
+    def invalidate(self, key: str = None):
+        """Drop one key, or every key when key is None.
+
+        Loads started before are not stored.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._versions.clear()
+                self._generation += 1
+            else:
+                self._entries.pop(key, None)
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _version(self, key: str) -> tuple[int, int]:
+        return self._generation, self._versions.get(key, 0)
+
+    def _refresh(self, key: str, loader: Callable[[], Optional[Any]], version: tuple[int, int]):
+        value = None
+        try:
+            value = loader()
+        except Exception as e:
+            logger.error(f"revalidate {key} error = {e}")
+        finally:
+            self._store(key, value, version)
+            with self._lock:
+                self._refreshing.discard(key)
+                self.refreshes += 1
+
+    def _store(self, key: str, value: Optional[Any], version: tuple[int, int]):
+        if value is None:
+            return
+        with self._lock:
+            if self._version(key) == version:
+                self._entries[key] = (time.monotonic(), value)
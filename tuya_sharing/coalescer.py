@@ -0,0 +1,120 @@
+"""Coalescing of bursty device reports."""
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from typing import Callable, Optional
+
+from .customerlogging import logger
+from .device import CustomerDevice
+
+
+class ReportCoalescer:
+    """Merge the status reports of a device arriving within a short window.
+
+    The first report of a device opens a window, every report until the
+    window closes only adds its changed codes, and listeners are notified
+    once with the union of the codes when it closes. The status values are
+    written to the device as they arrive, so the notification always sees
+    the latest values.
+
+    All windows are closed by a single scheduler thread.
+
+    Args:
+        notify: called with the device and the changed status codes
+        windows(dict): category to window length in seconds, categories
+            not listed are not coalesced
+    """
+
+    def __init__(
+            self,
+            notify: Callable[[CustomerDevice, list[str]], None],
+            windows: dict[str, float],
+    ):
+        self.notify = notify
+        self.windows = windows
+        self._pending: dict[str, tuple[CustomerDevice, list[str]]] = {}
+        self._deadlines: list[tuple[float, str]] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self.reports = 0
+        self.notifications = 0
+
+    def submit(self, device: CustomerDevice, updated_status_properties: list[str]) -> bool:
+        """Coalesce a report, returns False if the device's category has no window."""
+        window = self.windows.get(getattr(device, "category", None), 0)
+        if window <= 0:
+            return False
+
+        with self._condition:
+            if self._stopped:
+                return False
+            self.reports += 1
+            pending = self._pending.get(device.id)
+            if pending is not None:
+                _, codes = pending
+                for code in updated_status_properties:
+                    if code not in codes:
+                        codes.append(code)
+                return True
+
+            self._pending[device.id] = (device, list(updated_status_properties))
+            heapq.heappush(self._deadlines, (time.monotonic() + window, device.id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tuya-sharing-coalescer", daemon=True)
+                self._thread.start()
+            elif self._deadlines[0][1] == device.id:
+                # the new window closes before the one the scheduler waits for
+                self._condition.notify()
+        return True
+
+    def flush(self):
+        """Notify every pending device now."""
+        with self._condition:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines.clear()
+        for device, codes in pending:
+            self._notify(device, codes)
+
+    def stop(self):
+        """Notify every pending device and stop the scheduler thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.flush()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            due = []
+            with self._condition:
+                while not self._stopped:
+                    if not self._deadlines:
+                        self._condition.wait()
+                        continue
+                    delay = self._deadlines[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, device_id = heapq.heappop(self._deadlines)
+                    pending = self._pending.pop(device_id, None)
+                    if pending is not None:
+                        due.append(pending)
+            for device, codes in due:
+                self._notify(device, codes)
+
+    def _notify(self, device: CustomerDevice, codes: list[str]):
+        self.notifications += 1
+        try:
+            self.notify(device, codes)
+        except Exception as e:
+            logger.error("coalesced update error = %s", e)
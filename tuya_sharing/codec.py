@@ -0,0 +1,85 @@
+"""JSON codec shared by the sdk.
+
+Decoding uses orjson when it is installed and falls back to the standard
+library. Encoding always produces exactly what the standard library
+would, because encoded strings are signed, encrypted and handed to users
+as status values, so it uses prebuilt encoders instead of a new one per call.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND_ORJSON = "orjson"
+BACKEND_JSON = "json"
+
+_compact_encoder = json.JSONEncoder(separators=(',', ':'))
+_default_encoder = json.JSONEncoder()
+
+_loads: Callable[[Union[str, bytes]], Any] = json.loads
+_backend = BACKEND_JSON
+
+
+def set_backend(backend: Union[str, Callable[[Union[str, bytes]], Any], None] = None):
+    """Select the decoder.
+
+    Args:
+        backend: "orjson", "json", a custom loads callable, or None to pick
+            the fastest installed backend
+    """
+    global _loads, _backend
+    if backend is None:
+        backend = BACKEND_ORJSON if orjson is not None else BACKEND_JSON
+
+    if callable(backend):
+        _loads = backend
+        _backend = getattr(backend, "__module__", None) or repr(backend)
+    elif backend == BACKEND_ORJSON:
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        _loads = orjson.loads
+        _backend = BACKEND_ORJSON
+    elif backend == BACKEND_JSON:
+        _loads = json.loads
+        _backend = BACKEND_JSON
+    else:
+        raise ValueError(f"unknown json backend {backend}")
+
+
+def get_backend() -> str:
+    """Name of the decoder in use."""
+    return _backend
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decode json from str or bytes.
+
+    Input the fast backend rejects but the standard library accepts, like
+    NaN, is decoded by the standard library.
+    """
+    try:
+        return _loads(data)
+    except ValueError:
+        if _loads is json.loads:
+            raise
+        return json.loads(data)
+
+
+def dumps(obj: Any, default: Callable[[Any], Any] = None) -> str:
+    """Encode like json.dumps(obj, default=default)."""
+    if default is None:
+        return _default_encoder.encode(obj)
+    return json.dumps(obj, default=default)
+
+
+def dumps_compact(obj: Any) -> str:
+    """Encode like json.dumps(obj, separators=(',', ':')), as used for request signing."""
+    return _compact_encoder.encode(obj)
+
+
+set_backend()
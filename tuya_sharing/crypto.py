@@ -0,0 +1,77 @@
+"""Request signing and envelope encryption."""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import os
+from typing import Union
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+NONCE_ALPHABET = b"ABCDEFGHJKMNPQRSTWXYZabcdefhijkmnprstwxyz2345678"
+NONCE_LENGTH = 12
+SIGN_HEADERS = ("X-appKey", "X-requestId", "X-sid", "X-time", "X-token")
+
+# maps random bytes onto the nonce alphabet, bytes from _NONCE_LIMIT on are dropped
+# so that every character is equally likely
+_NONCE_LIMIT = 256 - 256 % len(NONCE_ALPHABET)
+_NONCE_TABLE = bytes(NONCE_ALPHABET[i % len(NONCE_ALPHABET)] for i in range(256))
+_NONCE_REJECTED = bytes(range(_NONCE_LIMIT, 256))
+
+
+def random_nonce(length: int = NONCE_LENGTH) -> bytes:
+    """Nonce of uniformly drawn alphabet characters from the OS CSPRNG, usually in one call."""
+    nonce = os.urandom(length).translate(_NONCE_TABLE, _NONCE_REJECTED)
+    while len(nonce) < length:
+        nonce += os.urandom(length - len(nonce)).translate(_NONCE_TABLE, _NONCE_REJECTED)
+    return nonce
+
+
+def hash_key(rid: str, refresh_token: str) -> str:
+    """Per request key, md5 of request id and refresh token."""
+    return hashlib.md5((rid + refresh_token).encode("utf-8")).hexdigest()
+
+
+def generate_secret(rid: str, sid: str, key: str) -> bytes:
+    """Per request AES key derived from the request id, session id and hash key."""
+    message = key
+    mod = 16
+    if sid != "":
+        length = min(len(sid), mod)
+        message += "_" + "".join(sid[ord(sid[i]) % mod] for i in range(length))
+
+    checksum = hmac.new(rid.encode("utf-8"), message.encode("utf-8"), hashlib.sha256)
+    return checksum.hexdigest()[:16].encode("utf-8")
+
+
+def restful_sign(key: str, query_encdata: bytes, body_encdata: bytes, headers: dict[str, str]) -> str:
+    """HMAC-SHA256 of the signed headers followed by the encrypted query and body."""
+    sign_str = "||".join(
+        f"{item}={headers[item]}" for item in SIGN_HEADERS if headers.get(item, "") != ""
+    ).encode("utf-8")
+    if query_encdata:
+        sign_str += query_encdata
+    if body_encdata:
+        sign_str += body_encdata
+    return hmac.new(key.encode("utf-8"), sign_str, hashlib.sha256).hexdigest()
+
+
+class RequestCipher:
+    """AES-GCM cipher of one request, used for the request and its response."""
+
+    __slots__ = ("_aesgcm",)
+
+    def __init__(self, secret: bytes):
+        self._aesgcm = AESGCM(secret)
+
+    def encrypt(self, raw_data: bytes) -> bytes:
+        """Encrypt to base64(nonce) + base64(ciphertext)."""
+        nonce = random_nonce()
+        ciphertext = self._aesgcm.encrypt(nonce, raw_data, None)
+        return base64.b64encode(nonce) + base64.b64encode(ciphertext)
+
+    def decrypt(self, cipher_data: Union[str, bytes]) -> bytes:
+        """Decrypt base64(nonce + ciphertext)."""
+        cipher_data = base64.b64decode(cipher_data)
+        return self._aesgcm.decrypt(cipher_data[:NONCE_LENGTH], cipher_data[NONCE_LENGTH:], None)
@@ -1,6 +1,7 @@
-import json
 from enum import Enum
 
+from . import codec
+
 class CMDCCodeEnum(Enum):
     switch = 1
     switchOne = 2
@@ -113,7 +114,7 @@ def custom_convert(status_item, config_item):
                 if status_code == "colour_data" or status_code == "colour_data_v2":
                     skill_vo = get_skill_vo(config_item["pid"], status_item)
                     status_value = skill_vo.value
-                    my_json = json.loads(str(status_value))
+                    my_json = codec.loads(str(status_value))
                     v = int(my_json["v"])
                     if status_code == "colour_data":
                         status_value = (v * 100 / 255) if (v * 100 % 255 == 0) else (v * 100 / 255 + 1)
@@ -182,7 +183,7 @@ def get_skill_vo(pid, status_dto):
         return None
     if str(status_value).startswith("{"):
         try:
-            jsonObject = json.loads(str(status_value))
+            jsonObject = codec.loads(str(status_value))
             h = jsonObject["h"]
             s = jsonObject["s"]
             v = jsonObject["v"]
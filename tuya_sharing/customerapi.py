@@ -1,20 +1,31 @@
 """Customer API."""
 from __future__ import annotations
 
+import socket
 from typing import Any
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from . import codec, crypto
+from .crypto import RequestCipher
 from .customerlogging import logger
-import json
-import hmac
-import hashlib
-import random
-import base64
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .deadline import DeadlineExceeded, remaining_time
+from .retry import CircuitBreakers, CircuitOpenError, RetryPolicy
 import uuid
 from abc import ABCMeta
 
+import threading
 import time
 
+# (connect, read) timeout of a request in seconds
+DEFAULT_TIMEOUT = (5, 30)
+TOKEN_RENEWAL_AHEAD = 5 * 60
+TOKEN_RENEWAL_RETRY = 30
+# connections kept open to the endpoint, enough for the Manager fan-out
+DEFAULT_POOL_MAXSIZE = 16
+# idle seconds before TCP keep-alive probes start, so dead connections are noticed
+TCP_KEEPALIVE_IDLE = 60
+
 
 class CustomerTokenInfo:
     """CUstomer token info.
@@ -36,6 +47,20 @@ class CustomerTokenInfo:
 
 
 class CustomerApi:
+    """Customer API.
+
+    Failed GET requests are retried with jittered backoff according to
+    retry_policy, use retry.NO_RETRY to disable it. Every endpoint has a
+    circuit breaker that rejects requests with CircuitOpenError while the
+    endpoint keeps failing.
+
+    Up to pool_maxsize connections per host are kept alive and reused.
+
+    With coalesce_gets, a GET issued while an identical one is in flight
+    waits for it instead of going to the network, and gets the same response
+    object, which callers must not modify. coalesced_gets counts the calls
+    saved this way.
+    """
 
     def __init__(
             self,
@@ -43,15 +68,41 @@ class CustomerApi:
             client_id: str,
             user_code: str,
             end_point: str,
-            listener: SharingTokenListener
+            listener: SharingTokenListener,
+            timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+            retry_policy: RetryPolicy = None,
+            circuit_breakers: CircuitBreakers = None,
+            pool_connections: int = 10,
+            pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+            tcp_keepalive: bool = True,
+            coalesce_gets: bool = False,
     ):
         self.session = requests.session()
+        self.pool_maxsize = pool_maxsize
+        self._warmed_up = 0
+        adapter = _PoolAdapter(
+            socket_options=_keepalive_socket_options() if tcp_keepalive else None,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breakers = circuit_breakers if circuit_breakers is not None else CircuitBreakers()
         self.token_info = token_info
         self.client_id = client_id
         self.user_code = user_code
         self.endpoint = end_point
-        self.refresh_token = False
         self.token_listener = listener
+        self._refresh_lock = threading.Lock()
+        self._renewal_timer: threading.Timer | None = None
+        self._renewal_stopped = True
+        self._renewal_ahead = TOKEN_RENEWAL_AHEAD
+        self.coalesce_gets = coalesce_gets
+        self.coalesced_gets = 0
+        self._in_flight: dict[str, _InFlightCall] = {}
+        self._in_flight_lock = threading.Lock()
 
     def __request(
             self,
@@ -59,92 +110,86 @@ class CustomerApi:
             path: str,
             params: dict[str, Any] | None = None,
             body: dict[str, Any] | None = None,
+            refresh_token: bool = True,
+            timeout: float | tuple[float, float] | None = None,
     ) -> dict[str, Any] | None:
 
-        self.refresh_access_token_if_need()
-
-        rid = str(uuid.uuid4())
-        sid = ""
-        md5 = hashlib.md5()
-        rid_refresh_token = rid + self.token_info.refresh_token
-        md5.update(rid_refresh_token.encode('utf-8'))
-        hash_key = md5.hexdigest()
-        secret = _secret_generating(rid, sid, hash_key)
-
-        query_encdata = ""
-        if params is not None and len(params.keys()) > 0:
-            query_encdata = _form_to_json(params)
-            query_encdata = _aes_gcm_encrypt(query_encdata, secret)
-            params = {
-                "encdata": query_encdata
-            }
-            query_encdata = str(query_encdata, encoding="utf8")
-        body_encdata = ""
-        if body is not None and len(body.keys()) > 0:
-            body_encdata = _form_to_json(body)
-            body_encdata = _aes_gcm_encrypt(body_encdata, secret)
-            body = {
-                "encdata": str(body_encdata, encoding="utf8")
-            }
-            body_encdata = str(body_encdata, encoding="utf8")
-
-        t = int(time.time() * 1000)
-        headers = {
-            "X-appKey": self.client_id,
-            "X-requestId": rid,
-            "X-sid": sid,
-            "X-time": str(t),
-        }
-        if self.token_info is not None and len(self.token_info.access_token) > 0:
-            headers["X-token"] = self.token_info.access_token
-
-        sign = _restful_sign(hash_key,
-                             query_encdata,
-                             body_encdata,
-                             headers)
-        headers["X-sign"] = sign
-
-        response = self.session.request(
-            method, self.endpoint + path, params=params, json=body, headers=headers
-        )
-
-        if response.ok is False:
-            logger.error(
-                f"Response error: code={response.status_code}, content={response.content}"
-            )
-            return None
-
-        ret = response.json()
-        logger.debug("response before decrypt ret = %s", ret)
-
-        if not ret.get("success"):
-            raise Exception(f"network error:({ret['code']}) {ret['msg']}")
-
-        result = _aex_gcm_decrypt(ret.get("result"), secret)
-        try:
-            ret["result"] = json.loads(result)
-        except json.decoder.JSONDecodeError:
-            ret["result"] = result
-
-        logger.debug("response ret = %s", ret)
-        return ret
+        if refresh_token:
+            self.refresh_access_token_if_need()
+
+        breaker = self.circuit_breakers.get(path)
+        attempt = 0
+        while True:
+            attempt += 1
+            request_timeout = _request_timeout(self.timeout if timeout is None else timeout)
+            if not breaker.allow():
+                raise CircuitOpenError(f"circuit of {breaker.name} is open")
+
+            try:
+                # every attempt is a new request, with its own id, time and signature
+                cipher, request_params, request_body, headers = _encrypt_request(
+                    self.token_info, self.client_id, params, body
+                )
+                response = self.session.request(
+                    method, self.endpoint + path, params=request_params, json=request_body, headers=headers,
+                    timeout=request_timeout
+                )
+            except requests.RequestException as e:
+                breaker.record_failure()
+                delay = None
+                if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    delay = self.retry_policy.next_delay(method, attempt)
+                if delay is None:
+                    raise
+                logger.debug(f"retry {method} {path} in {delay:.2f}s after {e!r}")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # no outcome to record, do not keep a half open circuit waiting for this trial
+                breaker.release()
+                raise
+
+            if response.ok is False:
+                if self.retry_policy.is_retryable_status(response.status_code):
+                    breaker.record_failure()
+                    delay = self.retry_policy.next_delay(method, attempt)
+                    if delay is not None:
+                        logger.debug(f"retry {method} {path} in {delay:.2f}s after status {response.status_code}")
+                        time.sleep(delay)
+                        continue
+                else:
+                    breaker.record_success()
+                logger.error(
+                    f"Response error: code={response.status_code}, content={response.content}"
+                )
+                return None
+
+            breaker.record_success()
+            return _decrypt_response(codec.loads(response.content), cipher)
 
     def refresh_access_token_if_need(self):
+        """Refresh the access token if it expires within a minute.
 
-        if self.refresh_token:
+        Only one thread refreshes, the others wait for it and then use the new token.
+        """
+        if not self._token_need_refresh(60):
             return
 
-        now = int(time.time() * 1000)
-        expired_time = self.token_info.expire_time
+        with self._refresh_lock:
+            # another thread may have refreshed while we were waiting
+            if not self._token_need_refresh(60):
+                return
+            self._refresh_access_token()
 
-        if expired_time - 60 * 1000 > now:  # 1min
-            return
+    def _token_need_refresh(self, ahead: float) -> bool:
+        now = int(time.time() * 1000)
+        return self.token_info.expire_time - ahead * 1000 <= now
 
-        self.refresh_token = True
+    def _refresh_access_token(self):
         try:
-            response = self.get("/v1.0/m/token/" + self.token_info.refresh_token)
+            response = self.__request("GET", "/v1.0/m/token/" + self.token_info.refresh_token, refresh_token=False)
 
-            if response.get("success"):
+            if response and response.get("success"):
                 result = response.get("result", {})
                 token_info = {
                     "t": response["t"],
@@ -158,10 +203,108 @@ class CustomerApi:
                     self.token_listener.update_token(token_info)
         except Exception as e:
             logger.error("net work error = %s", e)
+
+    def start_token_renewal(self, ahead: float = TOKEN_RENEWAL_AHEAD):
+        """Renew the access token in the background ahead seconds before it expires.
+
+        So that requests never have to wait for a token refresh.
+        """
+        with self._refresh_lock:
+            self._renewal_ahead = ahead
+            self._renewal_stopped = False
+            self._schedule_token_renewal()
+
+    def stop_token_renewal(self):
+        """Stop renewing the access token in the background."""
+        with self._refresh_lock:
+            self._renewal_stopped = True
+            if self._renewal_timer is not None:
+                self._renewal_timer.cancel()
+                self._renewal_timer = None
+
+    def _schedule_token_renewal(self, delay: float = None):
+        # called with _refresh_lock held, so a concurrent stop cannot be undone
+        if self._renewal_stopped:
+            return
+        if delay is None:
+            now = int(time.time() * 1000)
+            delay = max((self.token_info.expire_time - now) / 1000 - self._renewal_ahead, 0)
+        if self._renewal_timer is not None:
+            self._renewal_timer.cancel()
+        self._renewal_timer = threading.Timer(delay, self._renew_token)
+        self._renewal_timer.daemon = True
+        self._renewal_timer.start()
+        logger.debug(f"token renewal scheduled in {delay} seconds")
+
+    def _renew_token(self):
+        with self._refresh_lock:
+            if self._renewal_stopped:
+                return
+            if self._token_need_refresh(self._renewal_ahead):
+                self._refresh_access_token()
+            # retry later if the refresh failed
+            delay = TOKEN_RENEWAL_RETRY if self._token_need_refresh(self._renewal_ahead) else None
+            self._schedule_token_renewal(delay)
+
+    def warm_up(self, connections: int = 1):
+        """Open connections to the endpoint ahead of the first requests.
+
+        Args:
+            connections (int): connections to open, at most pool_maxsize
+        """
+        pool = self._connection_pool()
+        connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        opened = []
+        try:
+            for _ in range(min(connections, self.pool_maxsize)):
+                conn = pool._get_conn()
+                opened.append(conn)
+                if getattr(conn, "sock", None) is None:
+                    conn.timeout = connect_timeout
+                    conn.connect()
+                    self._warmed_up += 1
+        except Exception as e:
+            logger.debug(f"warm up connection failed {e!r}")
         finally:
-            self.refresh_token = False
+            for conn in opened:
+                pool._put_conn(conn)
+
+    def _connection_pool(self):
+        """The urllib3 pool the session sends requests to the endpoint with."""
+        adapter = self.session.get_adapter(self.endpoint)
+        # the same settings session.request resolves, or the pool would not be the same
+        settings = self.session.merge_environment_settings(self.endpoint, {}, None, None, None)
+        if hasattr(adapter, "get_connection_with_tls_context"):
+            request = requests.Request("GET", self.endpoint).prepare()
+            return adapter.get_connection_with_tls_context(
+                request, settings["verify"], settings["proxies"], settings["cert"]
+            )
+        return adapter.get_connection(self.endpoint, settings["proxies"])
+
+    def connection_stats(self) -> dict[str, int]:
+        """Connections created and reused by the pools currently open."""
+        created = 0
+        requests_sent = 0
+        adapters = {id(adapter): adapter for adapter in self.session.adapters.values()}
+        for adapter in adapters.values():
+            pools = getattr(adapter, "poolmanager", None)
+            if pools is None:
+                continue
+            for key in pools.pools.keys():
+                pool = pools.pools.get(key)
+                if pool is None:
+                    continue
+                created += pool.num_connections
+                requests_sent += pool.num_requests
+        # warmed up connections were created without a request
+        return {
+            "created": created,
+            "reused": max(requests_sent - created + self._warmed_up, 0),
+            "requests": requests_sent,
+        }
 
-    def get(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+    def get(self, path: str, params: dict[str, Any] | None = None,
+            timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
         """Http Get.
 
         Requests the server to return specified resources.
@@ -169,14 +312,42 @@ class CustomerApi:
         Args:
             path (str): api path
             params (map): request parameter
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
 
         Returns:
             response: response body
         """
-        return self.__request("GET", path, params, None)
+        if not self.coalesce_gets:
+            return self.__request("GET", path, params, None, timeout=timeout)
+
+        # calls with another timeout do not share a request, it would not be theirs
+        key = _request_key(path, params, timeout)
+        while True:
+            with self._in_flight_lock:
+                call = self._in_flight.get(key)
+                if call is None:
+                    call = self._in_flight[key] = _InFlightCall()
+                    break
+                self.coalesced_gets += 1
+            call.wait(remaining_time())
+            # a leader that ran out of its own deadline says nothing about ours, send it again
+            if not call.deadline_exceeded:
+                return call.get()
+
+        try:
+            call.result = self.__request("GET", path, params, None, timeout=timeout)
+        except BaseException as e:
+            call.error = e
+            call.deadline_exceeded = _deadline_exceeded(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result
 
-    def post(self, path: str, params: dict[str, Any] | None = None, body: dict[str, Any] | None = None) -> dict[
-        str, Any]:
+    def post(self, path: str, params: dict[str, Any] | None = None, body: dict[str, Any] | None = None,
+             timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
         """Http Post.
 
         Requests the server to update specified resources.
@@ -185,13 +356,15 @@ class CustomerApi:
             path (str): api path
             params (map): request parameter
             body (map): request body
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
 
         Returns:
             response: response body
         """
-        return self.__request("POST", path, params, body)
+        return self.__request("POST", path, params, body, timeout=timeout)
 
-    def put(self, path: str, body: dict[str, Any] | None = None) -> dict[str, Any]:
+    def put(self, path: str, body: dict[str, Any] | None = None,
+            timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
         """Http Put.
 
         Requires the server to perform specified operations.
@@ -199,13 +372,15 @@ class CustomerApi:
         Args:
             path (str): api path
             body (map): request body
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
 
         Returns:
             response: response body
         """
-        return self.__request("PUT", path, None, body)
+        return self.__request("PUT", path, None, body, timeout=timeout)
 
-    def delete(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+    def delete(self, path: str, params: dict[str, Any] | None = None,
+               timeout: float | tuple[float, float] | None = None) -> dict[str, Any]:
         """Http Delete.
 
         Requires the server to delete specified resources.
@@ -213,92 +388,151 @@ class CustomerApi:
         Args:
             path (str): api path
             params (map): request param
+            timeout (float|tuple): (connect, read) timeout, defaults to the client's
 
         Returns:
             response: response body
         """
-        return self.__request("DELETE", path, params, None)
+        return self.__request("DELETE", path, params, None, timeout=timeout)
+
+
+class _InFlightCall:
+    """A GET in flight, shared by the identical calls made meanwhile."""
+
+    __slots__ = ("done", "result", "error", "deadline_exceeded")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        self.deadline_exceeded = False
+
+    def wait(self, timeout: float | None = None):
+        if not self.done.wait(timeout):
+            raise DeadlineExceeded("deadline exceeded waiting for an identical request")
+
+    def get(self) -> dict[str, Any] | None:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _deadline_exceeded(error: BaseException) -> bool:
+    """Whether a request failed because the deadline of its caller ran out.
+
+    Request timeouts are cut to the remaining time, so a timeout once the
+    deadline passed is the deadline's too.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return True
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+
+def _request_key(path: str, params: dict[str, Any] | None, timeout: Any) -> str:
+    key = f"{path} {timeout!r}"
+    if not params:
+        return key
+    # the order of the params does not change the request
+    return key + "?" + repr(sorted(params.items()))
+
+
+class _PoolAdapter(HTTPAdapter):
+    """HTTPAdapter that sets socket options on the connections of its pools."""
+
+    def __init__(self, socket_options: list[tuple[int, int, int]] | None = None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _keepalive_socket_options() -> list[tuple[int, int, int]]:
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # not available on every platform
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_KEEPALIVE_IDLE))
+    return options
+
+
+def _encrypt_request(
+        token_info: CustomerTokenInfo,
+        client_id: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+) -> tuple[RequestCipher, dict[str, Any] | None, dict[str, Any] | None, dict[str, str]]:
+    """Build the signed and encrypted request envelope.
+
+    Returns:
+        cipher of the request, encrypted params, encrypted body and signed headers
+    """
+    rid = str(uuid.uuid4())
+    sid = ""
+    key = crypto.hash_key(rid, token_info.refresh_token)
+    cipher = RequestCipher(crypto.generate_secret(rid, sid, key))
+
+    query_encdata = b""
+    if params is not None and len(params.keys()) > 0:
+        query_encdata = cipher.encrypt(_form_to_json(params).encode("utf-8"))
+        params = {
+            "encdata": query_encdata.decode("ascii")
+        }
+    body_encdata = b""
+    if body is not None and len(body.keys()) > 0:
+        body_encdata = cipher.encrypt(_form_to_json(body).encode("utf-8"))
+        body = {
+            "encdata": body_encdata.decode("ascii")
+        }
+
+    t = int(time.time() * 1000)
+    headers = {
+        "X-appKey": client_id,
+        "X-requestId": rid,
+        "X-sid": sid,
+        "X-time": str(t),
+    }
+    if token_info is not None and len(token_info.access_token) > 0:
+        headers["X-token"] = token_info.access_token
+
+    headers["X-sign"] = crypto.restful_sign(key, query_encdata, body_encdata, headers)
+    return cipher, params, body, headers
+
+
+def _decrypt_response(ret: dict[str, Any], cipher: RequestCipher) -> dict[str, Any]:
+    """Decrypt the result of a response envelope in place."""
+    logger.debug("response before decrypt ret = %s", ret)
+
+    if not ret.get("success"):
+        raise Exception(f"network error:({ret['code']}) {ret['msg']}")
+
+    result = cipher.decrypt(ret.get("result"))
+    try:
+        ret["result"] = codec.loads(result)
+    except ValueError:
+        ret["result"] = str(result, encoding="utf8")
+
+    logger.debug("response ret = %s", ret)
+    return ret
 
 
-def _random_nonce(e=32):
-    t = "ABCDEFGHJKMNPQRSTWXYZabcdefhijkmnprstwxyz2345678"
-    a = len(t)
-    n = ""
-    for i in range(e):
-        n += t[random.randint(0, a - 1)]
-    return n
+def _request_timeout(timeout: float | tuple[float, float]) -> float | tuple[float, float]:
+    """Cap a request timeout to the time left before the current deadline."""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("deadline exceeded before request")
+    if isinstance(timeout, tuple):
+        return tuple(min(item, remaining) for item in timeout)
+    return min(timeout, remaining)
 
 
 def _form_to_json(content: dict[str, Any] | None = None) -> str:
-    return json.dumps(content, separators=(',', ':'))
-
-
-def _aes_gcm_encrypt(raw_data: str, secret: str):
-    nonce = _random_nonce(12)
-    raw_data = raw_data.encode('utf-8')
-    secret = secret.encode('utf-8')
-    nonce = nonce.encode('utf-8')
-    cipher = AESGCM(secret)
-    ciphertext = cipher.encrypt(nonce, raw_data, None)
-
-    return base64.b64encode(nonce) + base64.b64encode(ciphertext)
-
-
-def _aex_gcm_decrypt(cipher_data: str, secret: str) -> str:
-    cipher_data = base64.b64decode(cipher_data)
-    nonce = cipher_data[:12]
-    cipher_text = cipher_data[12:]
-    secret = secret.encode('utf-8')
-    cipher = AESGCM(secret)
-    decrypt = cipher.decrypt(nonce, cipher_text, None)
-    return str(decrypt, encoding="utf8")
-
-
-def _secret_generating(rid, sid, hash_key) -> str:
-    message = hash_key
-    mod = 16
-    if sid != "":
-        sid_length = len(sid)
-        length = sid_length if sid_length < mod else mod
-        ecode = ""
-        for i in range(length):
-            idx = ord(sid[i]) % mod
-            ecode += sid[idx]
-        message += "_"
-        message += ecode
-
-    if isinstance(message, str):
-        message = message.encode('utf-8')
-    if isinstance(rid, str):
-        rid = rid.encode('utf-8')
-
-    checksum = hmac.new(rid, message, hashlib.sha256)
-    byte_temp = checksum.digest()
-    secret = byte_temp.hex()
-
-    return secret[:16]
-
-
-def _restful_sign(hash_key: str, query_encdata: str, body_encdata: str, data: dict[str, Any]) -> str:
-    headers = ["X-appKey", "X-requestId", "X-sid", "X-time", "X-token"]
-    header_sign_str = ""
-    for item in headers:
-        val = data.get(item, "")
-        if val != "":
-            header_sign_str += item + "=" + val + "||"
-
-    sign_str = header_sign_str[:-2]
-
-    if query_encdata is not None and query_encdata != "":
-        sign_str += query_encdata
-    if body_encdata is not None and body_encdata != "":
-        sign_str += body_encdata
-
-    sign_str = bytes(sign_str, 'utf-8')
-    hash_key = bytes(hash_key, 'utf-8')
-
-    hash_value = hmac.new(hash_key, sign_str, hashlib.sha256)
-    return hash_value.hexdigest()
+    return codec.dumps_compact(content)
 
 
 class SharingTokenListener(metaclass=ABCMeta):
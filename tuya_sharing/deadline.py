@@ -0,0 +1,70 @@
+"""Deadlines for operations made of several requests."""
+from __future__ import annotations
+
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("tuya_sharing_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The deadline of an operation passed before it completed."""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Bound every request made inside the block to finish within seconds.
+
+    Nested deadlines keep the earliest one, None leaves the current deadline as is.
+    """
+    if seconds is None:
+        yield
+        return
+
+    expire = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expire = min(expire, current)
+    token = _deadline.set(expire)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, None without a deadline."""
+    expire = _deadline.get()
+    if expire is None:
+        return None
+    return expire - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current deadline has passed."""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("deadline exceeded")
+
+
+def submit_with_context(executor: Executor, func: Callable[..., Any], *args: Any) -> Future:
+    """Like executor.submit, but carries the current deadline into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def map_with_deadline(executor: Executor, func: Callable[[Any], Any], items: Iterable[Any]) -> list[Any]:
+    """Like executor.map, but carries the current deadline into the worker threads.
+
+    When one call fails, the calls that have not started yet are cancelled
+    and the error is raised.
+    """
+    futures = [submit_with_context(executor, func, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
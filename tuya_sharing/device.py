@@ -1,12 +1,16 @@
 """device api."""
 from __future__ import annotations
 
+from concurrent.futures import Executor
 from types import SimpleNamespace
 from typing import Any, Optional
 import time
 
+from .cache import ProductCache
 from .customerapi import CustomerApi
 from .customerlogging import logger
+from .deadline import map_with_deadline
+from .strategy import DpConverter, strategy
 
 
 class DeviceFunction(SimpleNamespace):
@@ -65,6 +69,8 @@ class CustomerDevice(SimpleNamespace):
           status: Status set of the device
           function: Instruction set of the device
           status_range: Status value range set of the device
+          local_strategy: DP id to status strategy info
+          local_converters: DP id to converter compiled from local_strategy
     """
 
     id: str
@@ -86,6 +92,7 @@ class CustomerDevice(SimpleNamespace):
     set_up: Optional[bool] = False
     support_local: Optional[bool] = False
     local_strategy: dict[int, dict[str, Any]] = {}
+    local_converters: dict[int, DpConverter] = {}
 
     status: dict[str, Any] = {}
     function: dict[str, DeviceFunction] = {}
@@ -97,21 +104,32 @@ class CustomerDevice(SimpleNamespace):
 
 
 class DeviceRepository:
-    def __init__(self, customer_api: CustomerApi):
+    def __init__(self, customer_api: CustomerApi, product_cache: ProductCache = None):
         self.api = customer_api
         self.filter = Filter(10)
+        self.product_cache = product_cache
 
-    def query_devices_by_home(self, home_id: str) -> list[CustomerDevice]:
+    def query_devices_by_home(self, home_id: str, executor: Executor = None) -> list[CustomerDevice]:
         response = self.api.get(f"/v1.0/m/life/ha/home/devices", {"homeId": home_id})
-        return self._query_devices(response)
+        return self._query_devices(response, executor)
 
-    def query_devices_by_ids(self, ids: list) -> list[CustomerDevice]:
+    def query_devices_by_ids(self, ids: list, executor: Executor = None) -> list[CustomerDevice]:
         response = self.api.get("/v1.0/m/life/ha/devices/detail", {"devIds": ",".join(ids)})
-        return self._query_devices(response)
+        return self._query_devices(response, executor)
 
-    def _query_devices(self, response) -> list[CustomerDevice]:
+    def query_device_list_by_home(self, home_id: str) -> list[CustomerDevice]:
+        """Query the devices of a home without their specification and strategy info."""
+        response = self.api.get(f"/v1.0/m/life/ha/home/devices", {"homeId": home_id})
+        return self._parse_devices(response)
+
+    def _query_devices(self, response, executor: Executor = None) -> list[CustomerDevice]:
+        _devices = self._parse_devices(response)
+        self.update_devices_info(_devices, executor)
+        return _devices
+
+    def _parse_devices(self, response) -> list[CustomerDevice]:
         _devices = []
-        if response["success"]:
+        if response and response["success"]:
             for item in response["result"]:
                 device = CustomerDevice(**item)
                 status = {}
@@ -121,65 +139,130 @@ class DeviceRepository:
                         value = item_status["value"]
                         status[code] = value
                 device.status = status
-                self.update_device_specification(device)
-                self.update_device_strategy_info(device)
                 _devices.append(device)
         return _devices
 
+    def update_devices_info(self, devices: list[CustomerDevice], executor: Executor = None):
+        """Fetch specification and strategy info of devices.
+
+        With an executor the devices are fetched concurrently. When a product
+        cache is configured, only the first device of every product goes to
+        the cloud and the others are then served from the cache, or fetched
+        concurrently when the first fetch failed.
+        """
+        if executor is None:
+            for device in devices:
+                self._update_device_info(device)
+        else:
+            first_devices = devices
+            other_devices = []
+            if self.product_cache is not None:
+                first_devices = []
+                product_ids = set()
+                for device in devices:
+                    product_id = getattr(device, "product_id", None)
+                    if product_id and product_id in product_ids:
+                        other_devices.append(device)
+                    else:
+                        product_ids.add(product_id)
+                        first_devices.append(device)
+            map_with_deadline(executor, self._update_device_info, first_devices)
+            # mostly served from the cache, products whose first fetch failed go to the cloud concurrently
+            map_with_deadline(executor, self._update_device_info, other_devices)
+
+        if self.product_cache is not None:
+            self.product_cache.save()
+
+    def _update_device_info(self, device: CustomerDevice):
+        self.update_device_specification(device)
+        self.update_device_strategy_info(device)
+
     def update_device_specification(self, device: CustomerDevice):
         device_id = device.id
-        response = self.api.get(f"/v1.1/m/life/{device_id}/specifications")
-        if response.get("success"):
+        product_id = getattr(device, "product_id", None)
+        result = None
+        if self.product_cache is not None and product_id:
+            result = self.product_cache.get_specification(product_id)
+
+        if result is None:
+            response = self.api.get(f"/v1.1/m/life/{device_id}/specifications")
+            if not response or not response.get("success"):
+                return
             result = response.get("result", {})
-            function_map = {}
-            for function in result["functions"]:
-                code = function["code"]
-                function_map[code] = DeviceFunction(**function)
+            if self.product_cache is not None and product_id:
+                self.product_cache.set_specification(product_id, result)
 
-            status_range = {}
-            for status in result["status"]:
-                code = status["code"]
-                status_range[code] = DeviceStatusRange(**status)
+        function_map = {}
+        for function in result["functions"]:
+            code = function["code"]
+            function_map[code] = DeviceFunction(**function)
 
-            device.function = function_map
-            device.status_range = status_range
+        status_range = {}
+        for status in result["status"]:
+            code = status["code"]
+            status_range[code] = DeviceStatusRange(**status)
+
+        device.function = function_map
+        device.status_range = status_range
 
     def update_device_strategy_info(self, device: CustomerDevice):
         device_id = device.id
-        response = self.api.get(f"/v1.0/m/life/devices/{device_id}/status")
-        support_local = True
-        if response.get("success"):
+        product_id = getattr(device, "product_id", None)
+        result = None
+        if self.product_cache is not None and product_id:
+            result = self.product_cache.get_strategy(product_id)
+
+        if result is None:
+            response = self.api.get(f"/v1.0/m/life/devices/{device_id}/status")
+            if not response or not response.get("success"):
+                return
             result = response.get("result", {})
-            pid = result["productKey"]
-            dp_id_map = {}
-            for dp_status_relation in result["dpStatusRelationDTOS"]:
-                if not dp_status_relation["supportLocal"]:
-                    support_local = False
-                    break
-                # statusFormat valueDesc、valueType,enumMappingMap,pid
-                dp_id_map[dp_status_relation["dpId"]] = {
-                    "value_convert": dp_status_relation["valueConvert"],
-                    "status_code": dp_status_relation["statusCode"],
-                    "config_item": {
-                        "statusFormat": dp_status_relation["statusFormat"],
-                        "valueDesc": dp_status_relation["valueDesc"],
-                        "valueType": dp_status_relation["valueType"],
-                        "enumMappingMap": dp_status_relation["enumMappingMap"],
-                        "pid": pid,
-                    }
+            if self.product_cache is not None and product_id:
+                self.product_cache.set_strategy(product_id, result)
+
+        support_local = True
+        pid = result["productKey"]
+        dp_id_map = {}
+        for dp_status_relation in result["dpStatusRelationDTOS"]:
+            if not dp_status_relation["supportLocal"]:
+                support_local = False
+                break
+            # statusFormat valueDesc、valueType,enumMappingMap,pid
+            dp_id_map[dp_status_relation["dpId"]] = {
+                "value_convert": dp_status_relation["valueConvert"],
+                "status_code": dp_status_relation["statusCode"],
+                "config_item": {
+                    "statusFormat": dp_status_relation["statusFormat"],
+                    "valueDesc": dp_status_relation["valueDesc"],
+                    "valueType": dp_status_relation["valueType"],
+                    "enumMappingMap": dp_status_relation["enumMappingMap"],
+                    "pid": pid,
                 }
-            device.support_local = support_local
-            if support_local:
-                device.local_strategy = dp_id_map
+            }
+        device.support_local = support_local
+        if support_local:
+            device.local_strategy = dp_id_map
+            device.local_converters = compile_local_strategy(dp_id_map)
 
-            logger.debug(
-                f"device status strategy dev_id = {device_id} support_local = {support_local} local_strategy = {dp_id_map}")
+        logger.debug(
+            f"device status strategy dev_id = {device_id} support_local = {support_local} local_strategy = {dp_id_map}")
 
     def send_commands(self, device_id: str, commands: list[dict[str, Any]]):
         if self.filter.call(device_id, commands):
             self.api.post(f"/v1.1/m/thing/{device_id}/commands", None, {"commands": commands})
 
 
+def compile_local_strategy(local_strategy: dict[int, dict[str, Any]]) -> dict[int, DpConverter]:
+    """Compile the strategy of every dp into a converter."""
+    converters = {}
+    for dp_id, dp_id_item in local_strategy.items():
+        converter = strategy.compile(dp_id_item["value_convert"], dp_id_item["status_code"],
+                                     dp_id_item["config_item"])
+        if converter is not None:
+            converters[dp_id] = converter
+    return converters
+
+
 class Filter:
     def __init__(self, time: int):
         self.last_call_time = {}
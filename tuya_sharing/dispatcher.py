@@ -0,0 +1,155 @@
+"""MQ message dispatcher which moves message handling off the mqtt network thread."""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Literal, Optional
+
+from .customerlogging import logger
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_BLOCK = "block"
+
+_STOP = object()
+
+
+def message_device_id(msg: dict[str, Any]) -> Optional[str]:
+    """Device id a mq message belongs to, if any."""
+    data = msg.get("data", {})
+    dev_id = data.get("devId")
+    if dev_id is None:
+        dev_id = data.get("bizData", {}).get("devId")
+    return dev_id
+
+
+class MessageDispatcher:
+    """Dispatch mq messages to a handler on a pool of worker threads.
+
+    Every device is pinned to one worker, so the messages of one device are
+    handled in the order they were received while different devices are
+    handled in parallel.
+
+    Args:
+        handler: callable invoked with every message
+        workers(int): number of worker threads
+        max_queue_size(int): max pending messages per worker
+        overflow(str): what to do when a worker queue is full,
+            drop_oldest, drop_newest or block the mqtt thread
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[dict], None],
+            workers: int = 1,
+            max_queue_size: int = 1000,
+            overflow: Literal["drop_oldest", "drop_newest", "block"] = OVERFLOW_DROP_OLDEST,
+    ):
+        self.handler = handler
+        self.overflow = overflow
+        self._queues = [queue.Queue(max_queue_size) for _ in range(workers)]
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.handled = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        """Start the worker threads."""
+        if self._threads:
+            return
+        for index, message_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._work, args=(message_queue,), name=f"tuya-sharing-dispatcher-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """Stop the worker threads after the pending messages are handled."""
+        for message_queue in self._queues:
+            message_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def dispatch(self, msg: dict[str, Any]):
+        """Queue a message, called from the mqtt thread."""
+        dev_id = message_device_id(msg) or ""
+        message_queue = self._queue(dev_id)
+        item = (time.monotonic(), self.handler, (msg,))
+        with self._lock:
+            self.dispatched += 1
+
+        if self.overflow == OVERFLOW_BLOCK:
+            message_queue.put(item)
+            return
+
+        while True:
+            try:
+                message_queue.put_nowait(item)
+                return
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    logger.debug(f"dispatcher queue full, drop message of {dev_id}")
+                    return
+                try:
+                    message_queue.get_nowait()
+                    logger.debug("dispatcher queue full, drop oldest message")
+                except queue.Empty:
+                    pass
+
+    def call(self, dev_id: str, func: Callable[..., None], *args: Any):
+        """Run func(*args) on the worker of a device, after the messages of the device queued so far.
+
+        Waits for room when the queue is full.
+        """
+        with self._lock:
+            self.dispatched += 1
+        self._queue(dev_id).put((time.monotonic(), func, args))
+
+    def _queue(self, dev_id: str) -> queue.Queue:
+        return self._queues[zlib.crc32(dev_id.encode("utf8")) % len(self._queues)]
+
+    def queue_depth(self) -> int:
+        """Number of messages waiting to be handled."""
+        return sum(message_queue.qsize() for message_queue in self._queues)
+
+    def stats(self) -> dict[str, Any]:
+        """Dispatcher metrics."""
+        with self._lock:
+            return {
+                "workers": len(self._queues),
+                "queue_depth": self.queue_depth(),
+                "dispatched": self.dispatched,
+                "handled": self.handled,
+                "dropped": self.dropped,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+            }
+
+    def _work(self, message_queue: queue.Queue):
+        while True:
+            item = message_queue.get()
+            if item is _STOP:
+                return
+            received_time, func, args = item
+            lag = time.monotonic() - received_time
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error("dispatch message error = %s", e)
+            with self._lock:
+                self.handled += 1
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+from typing import Optional
+
+from .cache import StaleWhileRevalidateCache
 from .customerapi import CustomerApi
 
+HOMES_CACHE_KEY = "homes"
+
 
 class SmartLifeHome:
     def __init__(self, id: str, name: str):
@@ -10,17 +15,30 @@ class SmartLifeHome:
 
 
 class HomeRepository:
-    def __init__(self, customer_api: CustomerApi):
+    def __init__(self, customer_api: CustomerApi, cache: StaleWhileRevalidateCache = None):
         self.api = customer_api
+        self.cache = cache
 
     def query_homes(self) -> list[SmartLifeHome]:
+        if self.cache is not None:
+            homes = self.cache.get(HOMES_CACHE_KEY, self._query_homes)
+        else:
+            homes = self._query_homes()
+        return list(homes) if homes is not None else []
+
+    def invalidate(self):
+        """Drop the cached homes, the next query goes to the cloud."""
+        if self.cache is not None:
+            self.cache.invalidate(HOMES_CACHE_KEY)
+
+    def _query_homes(self) -> Optional[list[SmartLifeHome]]:
         response = self.api.get(f"/v1.0/m/life/users/homes")
 
-        if response.get("success", False):
+        if response and response.get("success", False):
             _homes = []
             for home in response["result"]:
                 _home = SmartLifeHome(str(home["ownerId"]), home["name"])
                 _homes.append(_home)
             return _homes
 
-        return []
+        return None
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Literal, Optional
 
-from .customerapi import CustomerApi, CustomerTokenInfo, SharingTokenListener
+from .cache import ProductCache, StaleWhileRevalidateCache
+from .coalescer import ReportCoalescer
+from .customerapi import DEFAULT_POOL_MAXSIZE, DEFAULT_TIMEOUT, CustomerApi, CustomerTokenInfo, SharingTokenListener
 from .device import DeviceRepository, CustomerDevice
 from .home import HomeRepository, SmartLifeHome
 from .scenes import SceneRepository
@@ -11,7 +14,14 @@ from .strategy import strategy
 
 from abc import ABCMeta, abstractclassmethod
 from .customerlogging import logger
-from .mq import SharingMQ
+from .deadline import deadline, map_with_deadline
+from .dispatcher import MessageDispatcher, OVERFLOW_DROP_OLDEST
+from .mq import SharingMQ, ShardedSharingMQ
+from .retry import RetryPolicy
+from .scheduler import BindDeviceScheduler
+from .snapshot import load_snapshot, save_snapshot
+import inspect
+import threading
 import time
 
 PROTOCOL_DEVICE_REPORT = 4
@@ -22,6 +32,7 @@ BIZCODE_NAME_UPDATE = "nameUpdate"
 BIZCODE_DPNAME_UPDATE = "dpNameUpdate"
 BIZCODE_BIND_USER = "bindUser"
 BIZCODE_DELETE = "delete"
+MQ_STOP_TIMEOUT = 5
 
 
 class Manager:
@@ -34,6 +45,21 @@ class Manager:
             end_point: str,
             token_response: dict[str, Any] = None,
             listener: SharingTokenListener = None,
+            product_cache: ProductCache = None,
+            max_workers: int = 8,
+            dispatcher_workers: int = 1,
+            dispatcher_queue_size: int = 1000,
+            dispatcher_overflow: Literal["drop_oldest", "drop_newest", "block"] = OVERFLOW_DROP_OLDEST,
+            coalesce_windows: dict[str, float] = None,
+            token_renewal: bool = True,
+            mq_shards: int = 1,
+            request_timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+            retry_policy: RetryPolicy = None,
+            warm_up_connections: int = 0,
+            coalesce_gets: bool = False,
+            home_cache: StaleWhileRevalidateCache = None,
+            scene_cache: StaleWhileRevalidateCache = None,
+            snapshot_path: str = None,
     ) -> None:
         self.terminal_id = terminal_id
         self.customer_api = CustomerApi(
@@ -42,51 +68,258 @@ class Manager:
             user_code,
             end_point,
             listener,
+            timeout=request_timeout,
+            retry_policy=retry_policy,
+            pool_maxsize=max(max_workers, DEFAULT_POOL_MAXSIZE),
+            coalesce_gets=coalesce_gets,
         )
+        if warm_up_connections > 0:
+            # open connections in the background, so that the first refresh does not pay the handshakes
+            threading.Thread(
+                target=self.customer_api.warm_up, args=(warm_up_connections,), name="tuya-sharing-warm-up",
+                daemon=True
+            ).start()
+        if token_renewal:
+            self.customer_api.start_token_renewal()
         self.device_map: dict[str, CustomerDevice] = {}
         self.user_homes: list[SmartLifeHome] = []
-        self.home_repository = HomeRepository(self.customer_api)
-        self.device_repository = DeviceRepository(self.customer_api)
+        self.max_workers = max_workers
+        self.device_cache_timings: dict[str, float] = {}
+        self.home_repository = HomeRepository(self.customer_api, home_cache)
+        self.device_repository = DeviceRepository(self.customer_api, product_cache)
         self.device_listeners = set()
+        # listeners implementing update_device(self, device) without updated_status_properties
+        self._legacy_update_listeners = set()
 
         self.mq = None
-        self.scene_repository = SceneRepository(self.customer_api)
+        self.mq_shards = mq_shards
+        self.dispatcher = None
+        if dispatcher_workers > 0:
+            self.dispatcher = MessageDispatcher(
+                self.on_message, dispatcher_workers, dispatcher_queue_size, dispatcher_overflow
+            )
+        self.bind_scheduler = BindDeviceScheduler(self._on_devices_bound)
+        self.coalescer = None
+        if coalesce_windows:
+            self.coalescer = ReportCoalescer(self._on_coalesced_report, coalesce_windows)
+        self.scene_repository = SceneRepository(self.customer_api, scene_cache, max_workers)
         self.user_repository = UserRepository(self.customer_api)
+        self.snapshot_path = snapshot_path
+        self.reconcile_thread: Optional[threading.Thread] = None
 
-    def update_device_cache(self):
-        self.device_map.clear()
-        homes = self.home_repository.query_homes()
+    def warm_start(self, timeout: Optional[float] = None) -> bool:
+        """Serve homes and devices from the snapshot and reconcile them with the cloud in the background.
+
+        Without a usable snapshot the device cache is updated from the cloud
+        before returning. The reconcile fetches the specification and strategy
+        info again, the snapshot only serves until it is done.
+
+        Args:
+            timeout (float): seconds the cloud update may take
+
+        Returns:
+            whether the snapshot was loaded
+        """
+        if not self.load_snapshot():
+            self.update_device_cache(timeout)
+            return False
+
+        self.reconcile_thread = threading.Thread(
+            target=self._reconcile, args=(timeout,), name="tuya-sharing-reconcile", daemon=True
+        )
+        self.reconcile_thread.start()
+        return True
+
+    def load_snapshot(self) -> bool:
+        """Load homes and devices from snapshot_path, returns whether it succeeded."""
+        if self.snapshot_path is None:
+            return False
+        start = time.monotonic()
+        snapshot = load_snapshot(self.snapshot_path, self.customer_api.token_info.uid)
+        if snapshot is None:
+            return False
+
+        homes, devices = snapshot
         self.user_homes = homes
+        self.device_map = {device.id: device for device in devices}
+        logger.debug(
+            f"load snapshot homes={len(homes)} devices={len(devices)} in {time.monotonic() - start:.3f}s")
+        return True
+
+    def save_snapshot(self) -> bool:
+        """Save homes and devices to snapshot_path, returns whether it succeeded.
+
+        The file holds the local keys of the devices, keep snapshot_path in a private directory.
+        """
+        if self.snapshot_path is None:
+            return False
+        return save_snapshot(
+            self.snapshot_path, self.customer_api.token_info.uid, self.user_homes, list(self.device_map.values())
+        )
+
+    def _reconcile(self, timeout: Optional[float] = None):
+        try:
+            # the specification and strategy info of the snapshot may be outdated, fetch it again
+            self._sync_devices(timeout, reuse_device_info=False)
+        except Exception as e:
+            logger.error("reconcile with the cloud error = %s", e)
+
+    def update_device_cache(self, timeout: Optional[float] = None) -> DeviceDiff:
+        """Reload homes and devices, with the specification and strategy info of every device.
+
+        Devices already known are updated in place and the device map is
+        swapped at once, so readers never see a partial map. Listeners are
+        not notified, see sync_devices.
+
+        Args:
+            timeout (float): seconds the whole refresh may take, raises
+                DeadlineExceeded and keeps the previous cache when it runs out
+
+        Returns:
+            the devices added, removed and changed
+        """
+        return self._sync_device_cache(timeout, reuse_device_info=False)
+
+    def sync_devices(self, timeout: Optional[float] = None) -> DeviceDiff:
+        """Bring the device cache in line with the cloud and notify listeners of what changed.
 
-        for home in homes:
-            devices_by_home = self.device_repository.query_devices_by_home(home.id)
-            for device in devices_by_home:
-                self.device_map[device.id] = device
+        Specification and strategy info is only fetched for products not
+        seen before, devices of known products reuse it.
+
+        Args:
+            timeout (float): seconds the sync may take
+
+        Returns:
+            the devices added, removed and changed
+        """
+        return self._sync_devices(timeout, reuse_device_info=True)
+
+    def _sync_devices(self, timeout: Optional[float], reuse_device_info: bool) -> DeviceDiff:
+        diff = self._sync_device_cache(timeout, reuse_device_info)
+        for device in diff.added:
+            self.__add_device(device)
+        for device_id in diff.removed:
+            self.__remove_device(device_id)
+        for device in diff.changed:
+            self.__update_device(device)
+        if self.mq is not None and (diff.added or diff.removed):
+            self.refresh_mq()
+        return diff
+
+    def _sync_device_cache(self, timeout: Optional[float], reuse_device_info: bool) -> DeviceDiff:
+        timings = {}
+        old_device_map = self.device_map
+        with deadline(timeout), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            start = time.monotonic()
+            # a full refresh always goes to the cloud, and homes may have changed since the scenes were cached
+            self.home_repository.invalidate()
+            self.scene_repository.invalidate()
+            homes = self.home_repository.query_homes()
+            timings["homes"] = time.monotonic() - start
+
+            start = time.monotonic()
+            devices = []
+            for devices_by_home in map_with_deadline(executor, self.device_repository.query_device_list_by_home,
+                                                     [home.id for home in homes]):
+                devices.extend(devices_by_home)
+            timings["device_lists"] = time.monotonic() - start
+
+            start = time.monotonic()
+            fetch_devices = devices
+            if reuse_device_info:
+                known_products = {}
+                for device in old_device_map.values():
+                    product_id = getattr(device, "product_id", None)
+                    if product_id and "function" in vars(device):
+                        known_products.setdefault(product_id, device)
+                fetch_devices = []
+                for device in devices:
+                    known_device = known_products.get(getattr(device, "product_id", None))
+                    if known_device is not None:
+                        _copy_device_info(known_device, device)
+                    else:
+                        fetch_devices.append(device)
+            self.device_repository.update_devices_info(fetch_devices, executor)
+            timings["device_info"] = time.monotonic() - start
+
+        diff = DeviceDiff()
+        device_map = {}
+        for device in devices:
+            existing = old_device_map.get(device.id)
+            if existing is None:
+                diff.added.append(device)
+                device_map[device.id] = device
+                continue
+            if _device_changed(existing, device):
+                # update in place, the device object may be held by listeners, attributes
+                # the host set itself, like set_up, are kept
+                vars(existing).update(vars(device))
+                diff.changed.append(existing)
+            device_map[device.id] = existing
+        diff.removed = [device_id for device_id in old_device_map if device_id not in device_map]
+
+        self.user_homes = homes
+        self.device_map = device_map
+        self.device_cache_timings = timings
+        logger.debug(
+            f"sync device cache homes={len(homes)} devices={len(devices)} added={len(diff.added)} "
+            f"removed={len(diff.removed)} changed={len(diff.changed)} info_fetched={len(fetch_devices)} "
+            f"timings={timings}")
+        self.save_snapshot()
+        return diff
 
     def report_version(self, ha_version: str, integration_version: str, sdk_version: str):
         logger.debug(
             f"report version ha_version={ha_version},integration_version={integration_version},sdk_version={sdk_version}")
         self.user_repository.user_version_report(ha_version, integration_version, sdk_version)
 
-    def _update_device_list_info_cache(self, ids: list[str]):
+    def _update_device_list_info_cache(self, ids: list[str]) -> list[CustomerDevice]:
         devices = self.device_repository.query_devices_by_ids(ids)
         for device in devices:
             self.device_map[device.id] = device
+        return devices
 
-    def refresh_mq(self):
-        if self.mq is not None:
-            self.mq.stop()
-            self.mq = None
+    def _on_devices_bound(self, ids: list[str]) -> list[str]:
+        devices = self._update_device_list_info_cache(ids)
+        for device in devices:
+            if self.mq is not None:
+                self.mq.subscribe_device(device.id, device)
+            for listener in self.device_listeners:
+                listener.add_device(device)
+        return [device.id for device in devices]
 
+    def refresh_mq(self):
         home_ids = [home.id for home in self.user_homes]
         device = [device for device in self.device_map.values() if
                   hasattr(device, "id") and getattr(device, "set_up", False)]
 
-        sharing_mq = SharingMQ(self.customer_api, home_ids, device)
+        if self.mq is not None:
+            # a sharded MQ is only alive while all of its shards are, otherwise it is rebuilt,
+            # a stopped MQ may still be alive while it exits
+            if self.mq.is_alive() and not self.mq.stopped:
+                # only subscribe and unsubscribe what changed on the live connection
+                self.mq.update_subscriptions(home_ids, device)
+                return
+            self.mq.stop()
+            self.mq.join(MQ_STOP_TIMEOUT)
+            self.mq = None
+
+        if self.mq_shards > 1:
+            sharing_mq = ShardedSharingMQ(self.customer_api, home_ids, device, self.mq_shards)
+        else:
+            sharing_mq = SharingMQ(self.customer_api, home_ids, device)
+        sharing_mq.set_device_filter(self._is_known_device)
         sharing_mq.start()
-        sharing_mq.add_message_listener(self.on_message)
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+            sharing_mq.add_message_listener(self.dispatcher.dispatch)
+        else:
+            sharing_mq.add_message_listener(self.on_message)
         self.mq = sharing_mq
 
+    def _is_known_device(self, device_id: str) -> bool:
+        return device_id in self.device_map
+
     def send_commands(
             self, device_id: str, commands: list[dict[str, Any]]
     ):
@@ -108,21 +341,42 @@ class Manager:
         """
         response = self.customer_api.post(f"/v1.0/m/ipc/{device_id}/stream/actions/allocate", None,
                                           {"type": stream_type})
-        if response["success"]:
+        if response and response["success"]:
             return response["result"]["url"]
         return None
 
+    def query_homes(self) -> list[SmartLifeHome]:
+        """Query the homes of the user.
+
+        Served from the home cache when the Manager was given one, a full
+        refresh of the device cache always queries the cloud.
+        """
+        return self.home_repository.query_homes()
+
+    def invalidate_homes(self):
+        """Drop the cached homes, the next query goes to the cloud."""
+        self.home_repository.invalidate()
+
     def query_scenes(self) -> list:
-        """Query home scenes."""
+        """Query home scenes.
+
+        Served from the scene cache when the Manager was given one. Homes
+        are queried concurrently, the errors of homes that failed are in
+        the errors attribute of the result.
+        """
         home_ids = [home.id for home in self.user_homes]
         return self.scene_repository.query_scenes(home_ids)
 
+    def invalidate_scenes(self, home_id: str = None):
+        """Drop the cached scenes of a home, or of every home when home_id is None."""
+        self.scene_repository.invalidate(home_id)
+
     def trigger_scene(self, home_id: str, scene_id: str):
         """Trigger home scene"""
         self.scene_repository.trigger_scene(home_id, scene_id)
 
     def on_message(self, msg: dict):
-        logger.debug(f"mq receive-> {msg}")
+        logger.debug("mq receive-> %s", msg)
 
         try:
             protocol = msg.get("protocol", 0)
@@ -137,52 +391,80 @@ class Manager:
         except Exception as e:
             logger.error("on message error = %s", e)
 
-    def __update_device(self, device: CustomerDevice):
-        for listener in self.device_listeners:
-            listener.update_device(device)
+    def _on_coalesced_report(self, device: CustomerDevice, updated_status_properties: list[str]):
+        if self.dispatcher is not None and self.dispatcher.running:
+            # keep the notification in order with the other messages of the device
+            self.dispatcher.call(device.id, self.__update_device, device, updated_status_properties)
+        else:
+            self.__update_device(device, updated_status_properties)
+
+    def __update_device(self, device: CustomerDevice, updated_status_properties: Optional[list[str]] = None):
+        for listener in list(self.device_listeners):
+            try:
+                if listener in self._legacy_update_listeners:
+                    listener.update_device(device)
+                else:
+                    listener.update_device(device, updated_status_properties)
+            except Exception as e:
+                logger.error(f"device listener {listener} update_device error = {e}")
+
+    def __add_device(self, device: CustomerDevice):
+        for listener in list(self.device_listeners):
+            try:
+                listener.add_device(device)
+            except Exception as e:
+                logger.error(f"device listener {listener} add_device error = {e}")
+
+    def __remove_device(self, device_id: str):
+        for listener in list(self.device_listeners):
+            try:
+                listener.remove_device(device_id)
+            except Exception as e:
+                logger.error(f"device listener {listener} remove_device error = {e}")
 
     def _on_device_report(self, device_id: str, status: list):
         device = self.device_map.get(device_id, None)
         if not device:
             return
-        logger.debug(f"mq _on_device_report-> {status}")
+        logger.debug("mq _on_device_report-> %s", status)
+        updated_status_properties = []
         if device.support_local:
             for item in status:
                 if "dpId" in item and "value" in item:
-                    dp_id_item = device.local_strategy[item["dpId"]]
-                    strategy_name = dp_id_item["value_convert"]
-                    config_item = dp_id_item["config_item"]
-                    dp_item = (dp_id_item["status_code"], item["value"])
-                    logger.debug(
-                        f"mq _on_device_report before strategy convert strategy_name={strategy_name},dp_item={dp_item},config_item={config_item}")
-                    code, value = strategy.convert(strategy_name, dp_item, config_item)
-                    logger.debug(f"mq _on_device_report after strategy convert code={code},value={value}")
-                    device.status[code] = value
+                    converter = device.local_converters.get(item["dpId"])
+                    if converter is not None:
+                        code, value = converter(item["value"])
+                    else:
+                        dp_id_item = device.local_strategy[item["dpId"]]
+                        dp_item = (dp_id_item["status_code"], item["value"])
+                        code, value = strategy.convert(dp_id_item["value_convert"], dp_item,
+                                                       dp_id_item["config_item"])
+                    logger.debug("mq _on_device_report strategy convert dp_id=%s code=%s value=%s",
+                                 item["dpId"], code, value)
+                    if _set_status(device, code, value) and code not in updated_status_properties:
+                        updated_status_properties.append(code)
         else:
             for item in status:
                 if "code" in item and "value" in item:
                     code = item["code"]
                     value = item["value"]
-                    device.status[code] = value
+                    if _set_status(device, code, value) and code not in updated_status_properties:
+                        updated_status_properties.append(code)
 
-        self.__update_device(device)
+        if not updated_status_properties:
+            logger.debug("mq _on_device_report no status changed dev_id=%s", device_id)
+            return
+        if self.coalescer is not None and self.coalescer.submit(device, updated_status_properties):
+            return
+        self.__update_device(device, updated_status_properties)
 
     def _on_device_other(self, device_id: str, biz_code: str, data: dict[str, Any]):
         logger.debug(f"mq _on_device_other-> {device_id} -- {biz_code}")
 
-        # bind device to user
+        # bind device to user, fetched later as es sync takes a moment
         if biz_code == BIZCODE_BIND_USER:
-            device_ids = [device_id]
-            # wait for es sync
-            time.sleep(1)
-
-            self._update_device_list_info_cache(device_ids)
-
-            if device_id in self.device_map.keys():
-                device = self.device_map.get(device_id)
-                self.mq.subscribe_device(device_id, device)
-                for listener in self.device_listeners:
-                    listener.add_device(device)
+            self.bind_scheduler.schedule(device_id)
+            return
 
         # device status update
         device = self.device_map.get(device_id, None)
@@ -208,25 +490,100 @@ class Manager:
 
     def add_device_listener(self, listener: SharingDeviceListener):
         """Add device listener."""
+        if not _accepts_updated_status_properties(listener):
+            self._legacy_update_listeners.add(listener)
         self.device_listeners.add(listener)
 
     def remove_device_listener(self, listener: SharingDeviceListener):
         """Remove device listener."""
         self.device_listeners.remove(listener)
+        self._legacy_update_listeners.discard(listener)
 
     def unload(self):
+        # pending coalesced reports are queued before the dispatcher drains its queues
+        if self.coalescer is not None:
+            self.coalescer.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.bind_scheduler.cancel()
+        # stop renewing first, expiring the terminal goes to the cloud and may fail
+        self.customer_api.stop_token_renewal()
         self.user_repository.unload(self.terminal_id)
 
 
+class DeviceDiff:
+    """Devices added, removed and changed by a sync of the device cache.
+
+    Attributes:
+        added(list): new devices
+        removed(list): ids of the devices gone
+        changed(list): known devices whose info or status changed, updated in place
+    """
+
+    def __init__(self):
+        self.added: list[CustomerDevice] = []
+        self.removed: list[str] = []
+        self.changed: list[CustomerDevice] = []
+
+
+_DEVICE_INFO_ATTRIBUTES = ("function", "status_range", "support_local", "local_strategy", "local_converters")
+
+
+def _copy_device_info(source: CustomerDevice, device: CustomerDevice):
+    """Give device the specification and strategy info of a device of the same product."""
+    source_vars = vars(source)
+    for name in _DEVICE_INFO_ATTRIBUTES:
+        if name in source_vars:
+            value = source_vars[name]
+            setattr(device, name, dict(value) if isinstance(value, dict) else value)
+
+
+def _device_changed(existing: CustomerDevice, device: CustomerDevice) -> bool:
+    """Whether a field of the device fetched from the cloud differs from the known device."""
+    existing_vars = vars(existing)
+    for name, value in vars(device).items():
+        # compiled converters are derived from local_strategy and do not compare by value
+        if name == "local_converters":
+            continue
+        if name not in existing_vars or existing_vars[name] != value:
+            return True
+    return False
+
+
+def _accepts_updated_status_properties(listener: SharingDeviceListener) -> bool:
+    """Whether update_device of the listener takes updated_status_properties after the device."""
+    try:
+        parameters = inspect.signature(listener.update_device).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    positional = 0
+    for parameter in parameters:
+        if parameter.kind == inspect.Parameter.VAR_POSITIONAL:
+            return True
+        if parameter.kind in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD):
+            positional += 1
+    return positional >= 2
+
+
+def _set_status(device: CustomerDevice, code: str, value: Any) -> bool:
+    """Set a status value, returns whether it changed."""
+    if code in device.status and device.status[code] == value:
+        return False
+    device.status[code] = value
+    return True
+
+
 class SharingDeviceListener(metaclass=ABCMeta):
     """Sharing device listener."""
 
     @abstractclassmethod
-    def update_device(self, device: CustomerDevice):
+    def update_device(self, device: CustomerDevice, updated_status_properties: Optional[list[str]] = None):
         """Update device info.
 
         Args:
             device(CustomerDevice): updated device info
+            updated_status_properties(list[str]): status codes changed by a report,
+                None when the update is not a status report (online, name...)
         """
         pass
 
@@ -2,18 +2,30 @@
 from __future__ import annotations
 
 import threading
+from . import codec
 from .customerapi import CustomerApi
 from typing import Any, Callable
-from requests.exceptions import RequestException
 import time
 from .customerlogging import logger
+from .deadline import DeadlineExceeded
+from .retry import CircuitOpenError
 from .device import CustomerDevice
 from paho.mqtt import client as mqtt
 from urllib.parse import urlsplit
-import json
+import bisect
+import hashlib
 import uuid
 
 CONNECT_FAILED_NOT_AUTHORISED = 5
+PROTOCOL_DEVICE_REPORT = 4
+SUBSCRIBE_FAILED = 128
+SUBSCRIBE_CHUNK_SIZE = 100
+# seconds before the mqtt config expires to rotate to a new one
+ROTATION_LEAD = 60
+ROTATION_SUBSCRIBE_TIMEOUT = 30
+# seconds duplicates are still suppressed after the old client is stopped
+ROTATION_DEDUPE_WINDOW = 10
+MQ_CONFIG_PATH = "/v1.0/m/life/ha/access/config"
 
 
 class SharingMQConfig:
@@ -32,26 +44,53 @@ class SharingMQConfig:
 
 
 class SharingMQ(threading.Thread):
-    def __init__(self, customer_api: CustomerApi, owner_ids: list, device: list[CustomerDevice]):
-        super().__init__()
+    def __init__(
+            self,
+            customer_api: CustomerApi,
+            owner_ids: list,
+            device: list[CustomerDevice],
+            subscribe_chunk_size: int = SUBSCRIBE_CHUNK_SIZE,
+            json_loads: Callable[[bytes], Any] = codec.loads,
+    ):
+        super().__init__(name="tuya-sharing-mq")
         self.api = customer_api
         self._stop_event = threading.Event()
+        self._rotate_event = threading.Event()
         self.client = None
+        self.client_user_data = None
         self.mq_config = None
         self.message_listeners = set()
         self.owner_ids = owner_ids
         self.device = device
+        self.subscribe_chunk_size = subscribe_chunk_size
+        self.json_loads = json_loads
+        self.device_filter: Callable[[str], bool] | None = None
+        self.messages_discarded = 0
+        self._topic_devices: dict[str, str] = {}
+        self.granted_qos: dict[str, int] = {}
+        self.subscribe_elapsed: float | None = None
+        self._subscribe_lock = threading.Lock()
+        self._dedupe_lock = threading.Lock()
+        self._dedupe_until = 0
+        # fingerprint -> [last seen time, client that received it, times not yet matched on the other client]
+        self._seen_payloads: dict[bytes, list] = {}
+        self.connected = False
+        self.messages_received = 0
+        self.last_message_time: float | None = None
+        self._started_time = time.monotonic()
 
     def _get_mqtt_config(self) -> SharingMQConfig:
         link_id = f"tuya-device-sharing-sdk-python.{uuid.uuid1()}"
-        response = self.api.post("/v1.0/m/life/ha/access/config", None,
+        response = self.api.post(MQ_CONFIG_PATH, None,
                                  {"linkId": link_id})
-        if (response.get("success"), False) is False:
+        if not response or not response.get("success", False):
             raise Exception("get mqtt config error.")
 
         return SharingMQConfig(response)
 
     def _on_disconnect(self, client, userdata, rc):
+        if client is self.client:
+            self.connected = False
         if rc != 0:
             logger.error(f"Unexpected disconnection.{rc}")
         else:
@@ -60,24 +99,82 @@ class SharingMQ(threading.Thread):
     def _on_connect(self, mqttc: mqtt.Client, user_data: Any, flags, rc):
         logger.debug(f"connect flags->{flags}, rc->{rc}")
         if rc == 0:
-            for owner_id in self.owner_ids:
-                mqttc.subscribe(self.mq_config.owner_topic.format(ownerId=owner_id))
-            for dev in self.device:
-                dev_id = dev.id
-                topic_str = self.subscribe_topic(dev_id, dev.support_local)
-                mqttc.subscribe(topic_str)
+            self.connected = True
+            topics = self._topics(self.owner_ids, self.device)
+            if not topics:
+                # nothing to subscribe, a rotation must not wait for an acknowledgement
+                user_data["subscribed"].set()
+                return
+            user_data["subscribeStart"] = time.monotonic()
+            self._subscribe(mqttc, user_data, topics)
 
         elif rc == CONNECT_FAILED_NOT_AUTHORISED:
-            self.__run_mqtt()
+            # rotate to a new config on the mq thread rather than the network thread
+            self._rotate_event.set()
+
+    def _subscribe(self, mqttc: mqtt.Client, user_data: dict[str, Any], topics: list[str]):
+        """Subscribe topics with as few SUBSCRIBE packets as the chunk size allows."""
+        pending = user_data["pendingSubscribes"]
+        for index in range(0, len(topics), self.subscribe_chunk_size):
+            chunk = topics[index:index + self.subscribe_chunk_size]
+            with self._subscribe_lock:
+                result, mid = mqttc.subscribe([(topic, 0) for topic in chunk])
+                if result == mqtt.MQTT_ERR_SUCCESS:
+                    pending[mid] = chunk
+                else:
+                    logger.error(f"subscribe error {result}, topics={len(chunk)}")
+
+    def _topics(self, owner_ids: list, device: list[CustomerDevice]) -> list[str]:
+        topics = [self.mq_config.owner_topic.format(ownerId=owner_id) for owner_id in owner_ids]
+        for dev in device:
+            topics.append(self.subscribe_topic(dev.id, dev.support_local))
+        return topics
+
+    def _unsubscribe(self, mqttc: mqtt.Client, topics: list[str]):
+        for index in range(0, len(topics), self.subscribe_chunk_size):
+            chunk = topics[index:index + self.subscribe_chunk_size]
+            mqttc.unsubscribe(chunk)
+            for topic in chunk:
+                self.granted_qos.pop(topic, None)
 
     def subscribe_device(self, dev_id: str, device: CustomerDevice):
         self.device.append(device)
         topic = self.subscribe_topic(dev_id, device.support_local)
-        self.client.subscribe(topic)
+        self._subscribe(self.client, self.client_user_data, [topic])
 
     def un_subscribe_device(self, dev_id: str, support_local: bool):
+        self.device = [dev for dev in self.device if dev.id != dev_id]
         topic = self.subscribe_topic(dev_id, support_local)
-        self.client.unsubscribe(topic)
+        self._unsubscribe(self.client, [topic])
+
+    def update_subscriptions(self, owner_ids: list, device: list[CustomerDevice]):
+        """Subscribe and unsubscribe only the topics that changed on the live connection.
+
+        Returns:
+            number of topics subscribed and unsubscribed
+        """
+        client = self.client
+        if client is None or self.mq_config is None:
+            # not connected yet, the new topics are subscribed on connect
+            self.owner_ids = owner_ids
+            self.device = device
+            return 0, 0
+
+        old_topics = self._topics(self.owner_ids, self.device)
+        new_topics = self._topics(owner_ids, device)
+        self.owner_ids = owner_ids
+        self.device = device
+
+        old_topic_set = set(old_topics)
+        new_topic_set = set(new_topics)
+        added = [topic for topic in new_topics if topic not in old_topic_set]
+        removed = [topic for topic in old_topics if topic not in new_topic_set]
+        if removed:
+            self._unsubscribe(client, removed)
+        if added:
+            self._subscribe(client, self.client_user_data, added)
+        logger.debug(f"update subscriptions added={len(added)} removed={len(removed)}")
+        return len(added), len(removed)
 
     def subscribe_topic(self, dev_id: str, support_local: bool) -> str:
         subscribe_topic = self.mq_config.dev_topic.format(devId=dev_id)
@@ -85,23 +182,72 @@ class SharingMQ(threading.Thread):
             subscribe_topic += "/pen"
         else:
             subscribe_topic += "/sta"
+        self._topic_devices[subscribe_topic] = dev_id
         return subscribe_topic
 
     def _on_message(self, mqttc: mqtt.Client, user_data: Any, msg: mqtt.MQTTMessage):
-        logger.debug(f"payload-> {msg.payload}")
+        payload = msg.payload
+        logger.debug("payload-> %s", payload)
+
+        if self._is_duplicate(payload, mqttc):
+            logger.debug("drop duplicate message received during rotation")
+            return
 
-        msg_dict = json.loads(msg.payload.decode("utf8"))
+        self.messages_received += 1
+        self.last_message_time = time.time()
 
-        logger.debug(f"on_message: {msg_dict}")
+        # drop reports of devices which are gone before parsing them
+        device_filter = self.device_filter
+        if device_filter is not None:
+            dev_id = self._topic_devices.get(msg.topic)
+            if dev_id is not None and not device_filter(dev_id):
+                self.messages_discarded += 1
+                logger.debug("drop message of unknown device %s", dev_id)
+                return
+
+        try:
+            msg_dict = self.json_loads(payload)
+        except ValueError as e:
+            logger.error("mq payload decode error = %s", e)
+            return
+
+        if device_filter is not None and msg_dict.get("protocol") == PROTOCOL_DEVICE_REPORT:
+            dev_id = msg_dict.get("data", {}).get("devId")
+            if dev_id is not None and not device_filter(dev_id):
+                self.messages_discarded += 1
+                logger.debug("drop message of unknown device %s", dev_id)
+                return
+
+        logger.debug("on_message: %s", msg_dict)
 
         for listener in self.message_listeners:
             listener(msg_dict)
 
+    def set_device_filter(self, device_filter: Callable[[str], bool] | None):
+        """Only dispatch device reports for which device_filter(dev_id) is true."""
+        self.device_filter = device_filter
+
     def _on_subscribe(self, mqttc: mqtt.Client, user_data: Any, mid, granted_qos):
-        logger.debug(f"_on_subscribe: {mid}")
+        logger.debug("_on_subscribe: %s", mid)
+        with self._subscribe_lock:
+            pending = user_data["pendingSubscribes"]
+            topics = pending.pop(mid, [])
+            for topic, qos in zip(topics, granted_qos):
+                if qos == SUBSCRIBE_FAILED:
+                    logger.error(f"subscribe failed, topic={topic}")
+                    continue
+                self.granted_qos[topic] = qos
+
+            subscribe_start = user_data["subscribeStart"]
+            if not pending and subscribe_start is not None:
+                user_data["subscribeStart"] = None
+                self.subscribe_elapsed = time.monotonic() - subscribe_start
+                user_data["subscribed"].set()
+                logger.debug(f"all topics subscribed in {self.subscribe_elapsed} seconds, "
+                             f"topics={len(self.granted_qos)}")
 
     def _on_log(self, mqttc: mqtt.Client, user_data: Any, level, string):
-        logger.debug(f"_on_log: {string}")
+        logger.debug("_on_log: %s", string)
 
     def run(self):
         """Method representing the thread's activity which should not be used directly."""
@@ -111,31 +257,138 @@ class SharingMQ(threading.Thread):
                 self.__run_mqtt()
                 backoff_seconds = 1
 
-                # reconnect every 2 hours required.
-                time.sleep(self.mq_config.expire_time - 60)
-            except RequestException as e:
+                # reconnect every 2 hours required, rotate ahead of the expiry.
+                self._wait(max(self.mq_config.expire_time - ROTATION_LEAD, 0))
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                # a request before the circuit half opens would be rejected again
+                wait_seconds = max(backoff_seconds, self._config_reset_timeout())
+                logger.error(f"failed to refresh mqtt server: {e}, retrying in {wait_seconds} seconds.")
+
+                self._wait(wait_seconds)
+                backoff_seconds = min(backoff_seconds * 2, 60)
+            except Exception as e:
+                # RequestException or a failed config response, keep the thread alive
                 logger.exception(e)
                 logger.error(f"failed to refresh mqtt server, retrying in {backoff_seconds} seconds.")
 
-                time.sleep(backoff_seconds)
+                self._wait(backoff_seconds)
                 backoff_seconds = min(backoff_seconds * 2, 60)  # Try at most every 60 seconds to refresh
 
+        # stop may have raced with a connect
+        self._disconnect()
+        logger.debug("mq thread exit")
+
+    def _config_reset_timeout(self) -> float:
+        circuit_breakers = getattr(self.api, "circuit_breakers", None)
+        if circuit_breakers is None:
+            return 0
+        return circuit_breakers.get(MQ_CONFIG_PATH).reset_timeout
+
+    def _wait(self, timeout: float):
+        """Wait until the timeout elapses, a rotation is requested or the mq is stopped."""
+        self._rotate_event.wait(timeout)
+        self._rotate_event.clear()
+
+    def _disconnect(self):
+        client = self.client
+        self.client = None
+        if client is None:
+            return
+        try:
+            client.disconnect()
+            client.loop_stop()
+        except Exception as e:
+            logger.error("mq disconnect error %s", e)
+
     def __run_mqtt(self):
+        """Connect with a fresh config, make before break if a client is connected.
+
+        The new client is connected and its subscriptions acknowledged before
+        the old one is disconnected, and messages received on both clients
+        during the overlap are delivered once.
+        """
         mq_config = self._get_mqtt_config()
 
         self.mq_config = mq_config
 
-        logger.debug(f"connecting {mq_config.url}")
-        mqttc = self._start(mq_config)
+        old_client = self.client
+        if old_client is None:
+            logger.debug(f"connecting {mq_config.url}")
+            self.client, self.client_user_data = self._start(mq_config)
+            return
+
+        self._start_dedupe()
+        try:
+            logger.debug(f"connecting {mq_config.url}")
+            mqttc, user_data = self._start(mq_config)
+
+            if not user_data["subscribed"].wait(ROTATION_SUBSCRIBE_TIMEOUT):
+                logger.error("rotation: new client subscriptions not acknowledged, switching anyway")
+
+            self.client = mqttc
+            self.client_user_data = user_data
+
+            # let the old client handle what it already received, then stop it
+            old_client.disconnect()
+            old_client.loop_stop()
+            logger.debug("rotation: switched to new mqtt client")
+        finally:
+            # a failed rotation keeps the old client, without fingerprinting its messages
+            self._stop_dedupe()
 
-        if self.client:
-            self.client.disconnect()
-        self.client = mqttc
+    def _start_dedupe(self):
+        with self._dedupe_lock:
+            self._dedupe_until = float("inf")
 
-    def _start(self, mq_config: SharingMQConfig) -> mqtt.Client:
+    def _stop_dedupe(self):
+        with self._dedupe_lock:
+            self._dedupe_until = time.monotonic() + ROTATION_DEDUPE_WINDOW
+
+    def _is_duplicate(self, payload: bytes, mqttc: mqtt.Client) -> bool:
+        """Whether the payload was already received on the other client during a rotation.
+
+        A payload repeated on the same client is a new message and is kept.
+        """
+        if self._dedupe_until == 0:
+            return False
+        now = time.monotonic()
+        with self._dedupe_lock:
+            if now > self._dedupe_until:
+                self._dedupe_until = 0
+                self._seen_payloads.clear()
+                return False
+
+            while self._seen_payloads:
+                fingerprint, seen = next(iter(self._seen_payloads.items()))
+                if now - seen[0] <= ROTATION_DEDUPE_WINDOW:
+                    break
+                del self._seen_payloads[fingerprint]
+
+            fingerprint = hashlib.sha1(payload).digest()
+            seen = self._seen_payloads.pop(fingerprint, None)
+            if seen is not None and seen[1] is not mqttc:
+                # the other client delivered it already, match one of its copies
+                seen[2] -= 1
+                if seen[2] > 0:
+                    self._seen_payloads[fingerprint] = seen
+                return True
+            if seen is None:
+                seen = [now, mqttc, 0]
+            seen[0] = now
+            seen[2] += 1
+            self._seen_payloads[fingerprint] = seen
+            return False
+
+    def _start(self, mq_config: SharingMQConfig) -> tuple[mqtt.Client, dict[str, Any]]:
         mqttc = mqtt.Client(mq_config.client_id)
         mqttc.username_pw_set(mq_config.username, mq_config.password)
-        mqttc.user_data_set({"mqConfig": mq_config})
+        user_data = {
+            "mqConfig": mq_config,
+            "pendingSubscribes": {},
+            "subscribeStart": None,
+            "subscribed": threading.Event(),
+        }
+        mqttc.user_data_set(user_data)
         mqttc.on_connect = self._on_connect
         mqttc.on_message = self._on_message
         mqttc.on_subscribe = self._on_subscribe
@@ -149,7 +402,7 @@ class SharingMQ(threading.Thread):
         mqttc.connect(url.hostname, url.port)
 
         mqttc.loop_start()
-        return mqttc
+        return mqttc, user_data
 
     def start(self):
         """Start mqtt.
@@ -166,12 +419,20 @@ class SharingMQ(threading.Thread):
         """
         logger.debug("stop")
         self.message_listeners = set()
-        try:
-            self.client.disconnect()
-        except Exception as e:
-            logger.error("mq disconnect error %s", e)
-        self.client = None
         self._stop_event.set()
+        self._rotate_event.set()
+        self._disconnect()
+
+    @property
+    def stopped(self) -> bool:
+        """Whether stop was called, the thread may still be alive while it exits."""
+        return self._stop_event.is_set()
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait for the mq thread to exit, returns whether it did within timeout."""
+        if self.ident is not None:
+            super().join(timeout)
+        return not self.is_alive()
 
     def add_message_listener(self, listener: Callable[[dict], None]):
         """Add mqtt message listener."""
@@ -180,3 +441,136 @@ class SharingMQ(threading.Thread):
     def remove_message_listener(self, listener: Callable[[dict], None]):
         """Remvoe mqtt message listener."""
         self.message_listeners.discard(listener)
+
+    def stats(self) -> dict[str, Any]:
+        """Connection health and throughput."""
+        elapsed = time.monotonic() - self._started_time
+        return {
+            "alive": self.is_alive(),
+            "connected": self.connected,
+            "devices": len(self.device),
+            "topics": len(self.granted_qos),
+            "subscribe_elapsed": self.subscribe_elapsed,
+            "messages": self.messages_received,
+            "messages_discarded": self.messages_discarded,
+            "messages_per_second": self.messages_received / elapsed if elapsed > 0 else 0,
+            "last_message_time": self.last_message_time,
+        }
+
+
+def live_mq_threads() -> int:
+    """Number of SharingMQ threads still running, to detect leaked connections."""
+    return sum(1 for thread in threading.enumerate() if isinstance(thread, SharingMQ))
+
+
+class ConsistentHashRing:
+    """Map keys to shards so that changing the shard count moves few keys."""
+
+    def __init__(self, shards: int, replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f"{shard}-{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [hash_value for hash_value, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf8")).digest()[:8], "big")
+
+    def get_shard(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class ShardedSharingMQ:
+    """Spread device topics over several mqtt connections.
+
+    Every shard is a SharingMQ with its own config and link id, devices are
+    assigned to shards by consistent hashing of their id and owner topics
+    go to the first shard. A slow or dropped connection only affects the
+    devices of its shard.
+    """
+
+    def __init__(
+            self,
+            customer_api: CustomerApi,
+            owner_ids: list,
+            device: list[CustomerDevice],
+            shards: int = 2,
+            subscribe_chunk_size: int = SUBSCRIBE_CHUNK_SIZE,
+            json_loads: Callable[[bytes], Any] = codec.loads,
+    ):
+        self.ring = ConsistentHashRing(shards)
+        device_by_shard = self._split(device, shards)
+        self.shards = [
+            SharingMQ(customer_api, owner_ids if index == 0 else [], device_by_shard[index], subscribe_chunk_size,
+                      json_loads)
+            for index in range(shards)
+        ]
+
+    def _split(self, device: list[CustomerDevice], shards: int) -> list[list[CustomerDevice]]:
+        device_by_shard = [[] for _ in range(shards)]
+        for dev in device:
+            device_by_shard[self.ring.get_shard(dev.id)].append(dev)
+        return device_by_shard
+
+    def shard_of(self, dev_id: str) -> SharingMQ:
+        return self.shards[self.ring.get_shard(dev_id)]
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait for every shard thread to exit, returns whether they did within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for shard in self.shards:
+            shard.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not any(shard.is_alive() for shard in self.shards)
+
+    def is_alive(self) -> bool:
+        """Whether every shard is running, the devices of a dead shard get no updates."""
+        return all(shard.is_alive() for shard in self.shards)
+
+    @property
+    def stopped(self) -> bool:
+        """Whether a shard was stopped."""
+        return any(shard.stopped for shard in self.shards)
+
+    def subscribe_device(self, dev_id: str, device: CustomerDevice):
+        self.shard_of(dev_id).subscribe_device(dev_id, device)
+
+    def un_subscribe_device(self, dev_id: str, support_local: bool):
+        self.shard_of(dev_id).un_subscribe_device(dev_id, support_local)
+
+    def update_subscriptions(self, owner_ids: list, device: list[CustomerDevice]):
+        added = removed = 0
+        device_by_shard = self._split(device, len(self.shards))
+        for index, shard in enumerate(self.shards):
+            shard_added, shard_removed = shard.update_subscriptions(
+                owner_ids if index == 0 else [], device_by_shard[index]
+            )
+            added += shard_added
+            removed += shard_removed
+        return added, removed
+
+    def add_message_listener(self, listener: Callable[[dict], None]):
+        for shard in self.shards:
+            shard.add_message_listener(listener)
+
+    def remove_message_listener(self, listener: Callable[[dict], None]):
+        for shard in self.shards:
+            shard.remove_message_listener(listener)
+
+    def set_device_filter(self, device_filter: Callable[[str], bool] | None):
+        for shard in self.shards:
+            shard.set_device_filter(device_filter)
+
+    def stats(self) -> list[dict[str, Any]]:
+        """Health and throughput of every shard."""
+        return [shard.stats() for shard in self.shards]
@@ -0,0 +1,168 @@
+"""Retries and circuit breaking of cloud requests."""
+from __future__ import annotations
+
+import random
+import re
+import threading
+import time
+from typing import Iterable, Optional
+
+from .customerlogging import logger
+from .deadline import remaining_time
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# path segments holding an id, like a device id or a token, but not the api version
+_ID_SEGMENT = re.compile(r"/(?!v\d+(?:\.\d+)?(?:/|$))[^/]*\d[^/]*")
+
+
+class CircuitOpenError(Exception):
+    """The circuit of an endpoint is open, the request was not sent."""
+
+
+class RetryPolicy:
+    """When and how long to wait before sending a failed request again.
+
+    Only idempotent methods are retried, after a connection error, a timeout
+    or one of the retryable statuses. The wait is a random value between
+    zero and an exponentially growing cap, so that clients that failed
+    together do not retry together.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 2,
+            backoff: float = 0.5,
+            max_backoff: float = 8,
+            methods: Iterable[str] = ("GET",),
+            statuses: Iterable[int] = (429, 500, 502, 503, 504),
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = frozenset(method.upper() for method in methods)
+        self.statuses = frozenset(statuses)
+
+    def is_retryable_status(self, status: int) -> bool:
+        return status in self.statuses
+
+    def next_delay(self, method: str, attempt: int) -> Optional[float]:
+        """Seconds to wait before retry number attempt, None to give up.
+
+        Gives up as well when the wait would not fit in the current deadline.
+        """
+        if method.upper() not in self.methods or attempt > self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+
+NO_RETRY = RetryPolicy(max_retries=0)
+
+
+class CircuitBreaker:
+    """Fails fast after consecutive failures of an endpoint.
+
+    After failure_threshold failures in a row the circuit opens and requests
+    are rejected for reset_timeout seconds. Then a single trial request is
+    let through, its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.rejected = 0
+        self._state = CIRCUIT_CLOSED
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return CIRCUIT_HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return True
+            if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = CIRCUIT_HALF_OPEN
+            if self._state == CIRCUIT_HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CIRCUIT_CLOSED:
+                logger.info(f"circuit of {self.name} closed")
+            self._state = CIRCUIT_CLOSED
+            self._trial = False
+            self.failures = 0
+
+    def release(self):
+        """Give the half open trial back when a request ended without an outcome, like a cancellation."""
+        with self._lock:
+            if self._state == CIRCUIT_HALF_OPEN:
+                self._trial = False
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != CIRCUIT_OPEN:
+                    logger.warning(f"circuit of {self.name} opened after {self.failures} failures")
+                self._state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+class CircuitBreakers:
+    """One circuit breaker per endpoint, ids in paths share the breaker of their endpoint.
+
+    Args:
+        failure_threshold (int): consecutive failures opening a circuit, 0 disables breaking
+        reset_timeout (float): seconds a circuit stays open before a trial request
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> CircuitBreaker:
+        name = endpoint_name(path)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+                    self._breakers[name] = breaker
+        return breaker
+
+    def states(self) -> dict[str, str]:
+        """State of every endpoint seen so far."""
+        return {name: breaker.state for name, breaker in list(self._breakers.items())}
+
+
+def endpoint_name(path: str) -> str:
+    """Path with its id segments replaced, like /v1.1/m/life/{id}/specifications."""
+    return _ID_SEGMENT.sub("/{id}", path)
@@ -1,8 +1,14 @@
 """Tuya scene api."""
 
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
 from types import SimpleNamespace
-from typing import Any
+from typing import Any, Iterable, Optional
+from .async_customerapi import AsyncCustomerApi
+from .cache import StaleWhileRevalidateCache
 from .customerapi import CustomerApi
+from .customerlogging import logger
+from .deadline import submit_with_context
 
 
 class SharingScene(SimpleNamespace):
@@ -22,22 +28,125 @@ class SharingScene(SimpleNamespace):
     home_id: int
 
 
+class SceneList(list):
+    """Scenes of several homes.
+
+    Attributes:
+        errors(dict): error of every home whose scenes could not be queried
+    """
+
+    def __init__(self, scenes: Iterable[SharingScene] = (), errors: dict[str, Exception] = None):
+        super().__init__(scenes)
+        self.errors = errors if errors is not None else {}
+
+
 class SceneRepository:
-    def __init__(self, customer_api: CustomerApi):
+    """Scenes of homes.
+
+    The homes are queried concurrently, on the executor given to
+    query_scenes or on a pool of at most max_workers threads. A home that
+    fails is reported in the errors of the result instead of failing the
+    whole query.
+    """
+
+    def __init__(self, customer_api: CustomerApi, cache: StaleWhileRevalidateCache = None, max_workers: int = 8):
         self.api = customer_api
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def query_scenes(self, home_ids: list, executor: Executor = None) -> SceneList:
+        if executor is None and len(home_ids) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(home_ids))) as executor:
+                return self.query_scenes(home_ids, executor)
 
-    def query_scenes(self, home_ids: list) -> list[SharingScene]:
-        _scenes = []
-        for home_id in home_ids:
-            response = self.api.get("/v1.0/m/scene/ha/home/scenes", {"homeId": home_id})
-            if response["success"]:
-                for item in response["result"]:
-                    scene = SharingScene(**item)
-                    scene.home_id = home_id
-                    _scenes.append(scene)
+        if executor is None:
+            futures = None
+        else:
+            futures = [submit_with_context(executor, self._home_scenes, home_id) for home_id in home_ids]
+
+        _scenes = SceneList()
+        for index, home_id in enumerate(home_ids):
+            try:
+                scenes = self._home_scenes(home_id) if futures is None else futures[index].result()
+            except Exception as e:
+                logger.error(f"query scenes of home {home_id} error = {e}")
+                _scenes.errors[home_id] = e
+                continue
+            _scenes.extend(scenes)
 
         return _scenes
 
+    def invalidate(self, home_id: str = None):
+        """Drop the cached scenes of a home, or of every home when home_id is None."""
+        if self.cache is not None:
+            self.cache.invalidate(None if home_id is None else str(home_id))
+
+    def _home_scenes(self, home_id: str) -> list[SharingScene]:
+        if self.cache is not None:
+            scenes = self.cache.get(str(home_id), lambda: self._query_home_scenes(home_id))
+        else:
+            scenes = self._query_home_scenes(home_id)
+        if scenes is None:
+            raise Exception(f"query scenes of home {home_id} failed")
+        return scenes
+
+    def _query_home_scenes(self, home_id: str) -> Optional[list[SharingScene]]:
+        response = self.api.get("/v1.0/m/scene/ha/home/scenes", {"homeId": home_id})
+        return _parse_scenes(home_id, response)
+
     def trigger_scene(self, home_id: str, scene_id: str):
         response = self.api.post("/v1.0/m/scene/ha/trigger", None, {"homeId": home_id, "sceneId": scene_id})
+        if not response:
+            return None
         return response["result"]
+
+
+class AsyncSceneRepository:
+    """Scenes of homes for asyncio hosts, at most max_concurrency homes are queried at once."""
+
+    def __init__(self, customer_api: AsyncCustomerApi, max_concurrency: int = 8):
+        self.api = customer_api
+        self.max_concurrency = max_concurrency
+
+    async def query_scenes(self, home_ids: list) -> SceneList:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _query(home_id):
+            async with semaphore:
+                response = await self.api.get("/v1.0/m/scene/ha/home/scenes", {"homeId": home_id})
+            scenes = _parse_scenes(home_id, response)
+            if scenes is None:
+                raise Exception(f"query scenes of home {home_id} failed")
+            return scenes
+
+        results = await asyncio.gather(*[_query(home_id) for home_id in home_ids], return_exceptions=True)
+
+        _scenes = SceneList()
+        for home_id, result in zip(home_ids, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                logger.error(f"query scenes of home {home_id} error = {result}")
+                _scenes.errors[home_id] = result
+                continue
+            _scenes.extend(result)
+
+        return _scenes
+
+    async def trigger_scene(self, home_id: str, scene_id: str):
+        response = await self.api.post("/v1.0/m/scene/ha/trigger", None, {"homeId": home_id, "sceneId": scene_id})
+        if not response:
+            return None
+        return response["result"]
+
+
+def _parse_scenes(home_id: str, response: Optional[dict[str, Any]]) -> Optional[list[SharingScene]]:
+    if not response or not response["success"]:
+        return None
+
+    _scenes = []
+    for item in response["result"]:
+        scene = SharingScene(**item)
+        scene.home_id = home_id
+        _scenes.append(scene)
+    return _scenes
@@ -0,0 +1,106 @@
+"""Timer based scheduler for fetching newly bound devices."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Iterable
+
+from .customerlogging import logger
+
+
+class BindDeviceScheduler:
+    """Fetch newly bound devices off the mq thread, in batches and with retries.
+
+    The first device scheduled opens a batch window of delay seconds, the
+    devices scheduled before it closes are fetched with it in one call to
+    fetch, so a pairing burst is one request. Ids the cloud does not know yet (its search index syncs a little
+    after the bind message) are retried with exponential backoff.
+
+    Args:
+        fetch: called with a batch of device ids, returns the ids it found
+        delay(float): seconds to wait before the first fetch of a device
+        max_retries(int): retries of a device before giving up
+        max_backoff(float): upper bound of the retry delay in seconds
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[list[str]], Iterable[str]],
+            delay: float = 1,
+            max_retries: int = 5,
+            max_backoff: float = 30,
+    ):
+        self.fetch = fetch
+        self.delay = delay
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        # device id -> (attempt, due time)
+        self._pending: dict[str, tuple[int, float]] = {}
+        self._timer: threading.Timer | None = None
+        self._timer_due = 0.0
+        self._lock = threading.Lock()
+
+    def schedule(self, device_id: str):
+        """Schedule a device to be fetched."""
+        with self._lock:
+            if device_id in self._pending:
+                return
+            due = time.monotonic() + self.delay
+            if self._timer is not None and self._timer_due <= due:
+                # join the batch already waiting to be fetched
+                due = self._timer_due
+            self._pending[device_id] = (0, due)
+            self._reschedule()
+
+    def cancel(self, device_id: str = None):
+        """Stop fetching a device, or every device when device_id is None."""
+        with self._lock:
+            if device_id is None:
+                self._pending.clear()
+            else:
+                self._pending.pop(device_id, None)
+            if not self._pending and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _reschedule(self):
+        # called with the lock held
+        if not self._pending:
+            return
+        due = min(due for _, due in self._pending.values())
+        if self._timer is not None:
+            if self._timer_due <= due:
+                return
+            self._timer.cancel()
+        self._timer_due = due
+        self._timer = threading.Timer(max(due - time.monotonic(), 0), self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        now = time.monotonic()
+        with self._lock:
+            self._timer = None
+            batch = {device_id: attempt for device_id, (attempt, due) in self._pending.items() if due <= now}
+            for device_id in batch:
+                del self._pending[device_id]
+
+        found = set()
+        if batch:
+            try:
+                found = set(self.fetch(list(batch.keys())))
+            except Exception as e:
+                logger.error("fetch bound devices error = %s", e)
+
+        with self._lock:
+            for device_id, attempt in batch.items():
+                if device_id in found:
+                    continue
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"bound device not found after {attempt} attempts, dev_id = {device_id}")
+                    continue
+                backoff = min(self.delay * (2 ** attempt), self.max_backoff)
+                logger.debug(f"bound device not found, retry in {backoff} seconds, dev_id = {device_id}")
+                self._pending[device_id] = (attempt, time.monotonic() + backoff)
+            self._reschedule()
@@ -0,0 +1,95 @@
+"""Snapshot of homes and devices for warm starts."""
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Optional
+
+from . import codec
+from .customerlogging import logger
+from .device import CustomerDevice, DeviceFunction, DeviceStatusRange, compile_local_strategy
+from .home import SmartLifeHome
+
+SNAPSHOT_VERSION = 1
+# the snapshot holds device local keys
+SNAPSHOT_FILE_MODE = 0o600
+# device fields of the sdk, attributes the host sets itself like set_up and the
+# compiled converters are not saved
+_DEVICE_FIELDS = tuple(
+    name for name in CustomerDevice.__annotations__ if name not in ("set_up", "local_converters")
+)
+
+
+def save_snapshot(path: str, uid: str, homes: list[SmartLifeHome], devices: list[CustomerDevice]) -> bool:
+    """Write homes and devices of user uid to path, returns whether it succeeded.
+
+    The file holds the uid and the local_key of every device, it is only
+    readable and writable by its owner. Only the sdk fields of the devices
+    are saved, compiled converters are compiled again on load.
+    """
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "uid": uid,
+        "saved_time": time.time(),
+        "homes": [{"id": home.id, "name": home.name} for home in homes],
+        "devices": [_device_to_dict(device) for device in devices],
+    }
+    tmp_path = f"{path}.tmp"
+    try:
+        # a leftover temp file may have been created with wider permissions
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, SNAPSHOT_FILE_MODE)
+        with open(fd, "w", encoding="utf-8") as fileobj:
+            fileobj.write(codec.dumps(data))
+        os.replace(tmp_path, path)
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.error("save snapshot error = %s", e)
+        return False
+
+
+def load_snapshot(path: str, uid: str) -> Optional[tuple[list[SmartLifeHome], list[CustomerDevice]]]:
+    """Read the homes and devices saved for user uid.
+
+    Returns None when the file is missing, unreadable, of another version or of another user.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fileobj:
+            data = codec.loads(fileobj.read())
+        if data.get("version") != SNAPSHOT_VERSION or data.get("uid") != uid:
+            logger.debug(f"snapshot version or user mismatch, ignore {path}")
+            return None
+        homes = [SmartLifeHome(item["id"], item["name"]) for item in data["homes"]]
+        devices = [_device_from_dict(item) for item in data["devices"]]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error("load snapshot error = %s", e)
+        return None
+    return homes, devices
+
+
+def _device_to_dict(device: CustomerDevice) -> dict[str, Any]:
+    device_vars = vars(device)
+    item = {name: device_vars[name] for name in _DEVICE_FIELDS if name in device_vars}
+    if "function" in item:
+        item["function"] = {code: vars(function) for code, function in item["function"].items()}
+    if "status_range" in item:
+        item["status_range"] = {code: vars(status_range) for code, status_range in item["status_range"].items()}
+    return item
+
+
+def _device_from_dict(item: dict[str, Any]) -> CustomerDevice:
+    device = CustomerDevice(**item)
+    if "function" in item:
+        device.function = {code: DeviceFunction(**function) for code, function in item["function"].items()}
+    if "status_range" in item:
+        device.status_range = {
+            code: DeviceStatusRange(**status_range) for code, status_range in item["status_range"].items()
+        }
+    if "local_strategy" in item:
+        # json turned the dp ids into strings
+        device.local_strategy = {int(dp_id): dp_item for dp_id, dp_item in item["local_strategy"].items()}
+        device.local_converters = compile_local_strategy(device.local_strategy)
+    return device
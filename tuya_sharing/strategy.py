@@ -1,8 +1,55 @@
 from enum import Enum
 
+from . import codec
 from .custom_strategy import custom_convert
 
 
+def get_status_key(config_item: dict) -> str:
+    """Status code a dp converts to, pre-parsed when the config item was compiled."""
+    status_key = config_item.get("statusKey")
+    if status_key is None:
+        status_key, _ = codec.loads(config_item["statusFormat"]).popitem()
+    return status_key
+
+
+def get_value_desc(config_item: dict) -> dict:
+    """Value description of a dp, pre-parsed when the config item was compiled."""
+    value_desc = config_item.get("valueDescMap")
+    if value_desc is None:
+        value_desc = codec.loads(config_item["valueDesc"])
+    return value_desc
+
+
+def compile_config_item(config_item: dict) -> dict:
+    """Copy of a config item with statusFormat and valueDesc parsed ahead of time."""
+    config_item = dict(config_item)
+    try:
+        config_item["statusKey"], _ = codec.loads(config_item["statusFormat"]).popitem()
+    except (TypeError, ValueError, KeyError, AttributeError):
+        pass
+    try:
+        value_desc = codec.loads(config_item["valueDesc"])
+        if isinstance(value_desc, dict):
+            config_item["valueDescMap"] = value_desc
+    except (TypeError, ValueError, KeyError):
+        pass
+    return config_item
+
+
+class DpConverter(object):
+    """Ready to call converter of one dp of a device."""
+
+    __slots__ = ("func", "status_code", "config_item")
+
+    def __init__(self, func, status_code: str, config_item: dict):
+        self.func = func
+        self.status_code = status_code
+        self.config_item = config_item
+
+    def __call__(self, dp_value) -> tuple:
+        return self.func((self.status_code, dp_value), self.config_item)
+
+
 class Strategy(object):
     def __init__(self):
         self._strategies = {}
@@ -24,6 +71,12 @@ class Strategy(object):
         # status_item = custom_convert(status_item, config_item)
         # return status_item
 
+    def compile(self, name, status_code, config_item):
+        """Resolve the strategy of a dp once, returns None if it is not registered."""
+        if name not in self._strategies:
+            return None
+        return DpConverter(self._strategies[name], status_code, compile_config_item(config_item))
+
 # singleton
 strategy = Strategy()
 
@@ -1,13 +1,13 @@
-import json
 import base64
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("cz_timer1_alg")
 def convert(dp_item: tuple, config_item: dict) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -39,7 +39,7 @@ def convert_value(input, mark = False):
             tempVO["start_time"] = intArr2Str(input[i + 2], input[i + 3])
             tempVO["end_time"] = intArr2Str(input[i + 4], input[i + 5])
             vos.append(tempVO)
-    return json.dumps(vos)
+    return codec.dumps(vos)
 
 def integer2bool(integer):
     return integer > 0
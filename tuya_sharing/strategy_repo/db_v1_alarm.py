@@ -1,15 +1,15 @@
 import base64
-import json
 import math
 from enum import Enum
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_alarm")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -82,4 +82,4 @@ def convert_value(param):
             else:
                 vo['threshold'] = str(int(threshold))
         list.append(vo)
-    return json.dumps(list)
\ No newline at end of file
+    return codec.dumps(list)
\ No newline at end of file
@@ -1,13 +1,13 @@
 import base64
-import json
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_daily")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -24,7 +24,7 @@ class DBV1DailyElectricDataVO:
         self.electricTotal = 0.0
 
     def to_json(self):
-        return json.dumps(self.__dict__)
+        return codec.dumps(self.__dict__)
 
 def convert_value(data_str):
     vo = DBV1DailyElectricDataVO()
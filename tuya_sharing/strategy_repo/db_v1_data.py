@@ -1,15 +1,15 @@
 import base64
-import json
 import re
 from collections import namedtuple
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_data")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -32,7 +32,7 @@ def convert_value(str_input):
         minute = hex2dec(str_input[16:18]),
         second = hex2dec(str_input[18:20])
     )
-    return json.dumps(res._asdict())
+    return codec.dumps(res._asdict())
 
 def average_str(input_string, length):
     if length < 0:
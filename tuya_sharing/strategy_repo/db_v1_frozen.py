@@ -1,13 +1,13 @@
-import json
 import base64
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_frozen")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -39,4 +39,4 @@ def convert_value(str: str) -> str:
     vo = DBV1FrozenTimeVO()
     vo.day = hex2decimal(str[:2])
     vo.hour = hex2decimal(str[2:4])
-    return json.dumps(vo.__dict__)
\ No newline at end of file
+    return codec.dumps(vo.__dict__)
\ No newline at end of file
@@ -1,14 +1,13 @@
-import json
-
 import base64
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_month")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -46,4 +45,4 @@ def convert_value(str: str) -> str:
     vo.endYear = hex2decimal(str[4:6])
     vo.endMonth = hex2decimal(str[6:8])
     vo.electricTotal = hex2decimal(str[8:16]) / 100.0
-    return json.dumps(vo.__dict__)
\ No newline at end of file
+    return codec.dumps(vo.__dict__)
\ No newline at end of file
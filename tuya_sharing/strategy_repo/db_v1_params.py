@@ -1,14 +1,14 @@
 import base64
-import json
 from typing import Optional
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_params")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -29,7 +29,7 @@ def convert_value(s: str) -> str:
     vo.voltage = hex2decimal(s[0:4]) / 10.0
     vo.electricCurrent = hex2decimal(s[4:10]) / 1000.0
     vo.power = hex2decimal(s[10:16]) / 1000.0
-    return json.dumps(vo.__dict__)
+    return codec.dumps(vo.__dict__)
 
 
 def hex2decimal(hex_str: str) -> int:
@@ -1,14 +1,14 @@
 from base64 import b64decode
-import json
 import re
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("db_v1_tariff")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -69,7 +69,7 @@ def convert_value(str_input):
         elif i == 6:
             dbv1_tariff_period.sunday = timer_list
 
-    return json.dumps(dbv1_tariff_period.__dict__, default=lambda o: o.__dict__)
+    return codec.dumps(dbv1_tariff_period.__dict__, default=lambda o: o.__dict__)
 
 
 def average_str(input_string, string_length):
@@ -1,11 +1,11 @@
-import json
 from .. import strategy
+from ..strategy import get_status_key, get_value_desc
 
 
 @strategy.register("default")
 def convert(dp_item: tuple, config_item: dict) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is not None and dp_value != "":
         return status_key, dp_value
 
@@ -18,9 +18,9 @@ def convert_value(config_item):
     if value_type == "Boolean":
         status_value = False
     elif value_type == "Integer":
-        status_value = json.loads(config_item["valueDesc"]).get("min")
+        status_value = get_value_desc(config_item).get("min")
     elif value_type == "Enum":
-        status_value = json.loads(config_item["valueDesc"]).get("range")[0]
+        status_value = get_value_desc(config_item).get("range")[0]
     elif value_type in ["String", "Raw", "Bitmap"]:
         status_value = ""
     else:
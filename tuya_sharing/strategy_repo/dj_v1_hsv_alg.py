@@ -1,13 +1,13 @@
-import json
 from typing import Dict, Optional
 from colorsys import rgb_to_hsv
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("dj_v1_hsv_alg")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -87,7 +87,7 @@ def convert_value(str_colour_value: str) -> str:
         hsv_vo.s = scale_round(hsv_map["S"] * 255.0, 1)
         hsv_vo.v = scale_round(hsv_map["V"] * 255.0, 1)
 
-        return json.dumps(hsv_vo.__dict__)
+        return codec.dumps(hsv_vo.__dict__)
 
     vo = get_hsv_from_color_dp_value(str_colour_value)
 
@@ -96,4 +96,4 @@ def convert_value(str_colour_value: str) -> str:
     hsv_vo.s = scale_round(vo.saturation * 255.0, 1)
     hsv_vo.v = scale_round(vo.brightness * 255.0, 1)
 
-    return json.dumps(hsv_vo.__dict__)
\ No newline at end of file
+    return codec.dumps(hsv_vo.__dict__)
\ No newline at end of file
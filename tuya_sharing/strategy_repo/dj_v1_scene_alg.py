@@ -1,12 +1,12 @@
-import json
 from typing import List, Dict
 import colorsys
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 @strategy.register("dj_v1_scene_alg")
 def convert(dp_item: tuple, config_item: dict) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -80,4 +80,4 @@ def convert_value(str_colour_value: str) -> str:
 
         vo.hsv.append(item_vo)
 
-    return json.dumps(vo, default=lambda o: o.__dict__)
\ No newline at end of file
+    return codec.dumps(vo, default=lambda o: o.__dict__)
\ No newline at end of file
@@ -1,13 +1,13 @@
-import json
 from typing import Optional
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("dj_v2_color_alg")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -42,4 +42,4 @@ def convert_value(str_input: str) -> str:
     vo.h = hex2decimal(str_input[0:4])
     vo.s = hex2decimal(str_input[4:8])
     vo.v = hex2decimal(str_input[8:12])
-    return json.dumps(vo.__dict__)
+    return codec.dumps(vo.__dict__)
@@ -1,12 +1,11 @@
-import json
-
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("dj_v2_contr_alg")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -37,7 +36,7 @@ def convert_value(input_str):
     vo.v = hex2decimal(input_str[9:13])
     vo.bright = hex2decimal(input_str[13:17])
     vo.temperature = hex2decimal(input_str[17:])
-    return json.dumps(vo.__dict__)
+    return codec.dumps(vo.__dict__)
 
 
 def hex2decimal(hex_str: str) -> int:
@@ -1,13 +1,13 @@
-import json
 from typing import Optional
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("dj_v2_music_alg")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -44,7 +44,7 @@ def convert_value(str_: str) -> str:
     vo.bright = hex2decimal(str_[13:17])
     vo.temperature = hex2decimal(str_[17:])
 
-    return json.dumps(vo.__dict__)
+    return codec.dumps(vo.__dict__)
 
 
 def hex2decimal(hex_str: str) -> int:
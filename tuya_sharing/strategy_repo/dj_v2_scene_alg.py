@@ -1,13 +1,13 @@
-import json
 from typing import List
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("dj_v2_scene_alg")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -63,7 +63,7 @@ def convert_value(str: str) -> str:
         unit_vo.temperature = hex2decimal(item[22:])
         scene_units.append(unit_vo)
     vo.scene_units = scene_units
-    return json.dumps(vo.__dict__, default=lambda o: o.__dict__)
+    return codec.dumps(vo.__dict__, default=lambda o: o.__dict__)
 
 
 
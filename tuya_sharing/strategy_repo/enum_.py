@@ -1,6 +1,5 @@
-import json
-
 from .. import strategy
+from ..strategy import get_status_key
 from .default import convert_value as convert_default_value
 
 
@@ -15,7 +14,7 @@ def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     :return: 标准指令值
     """
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     enum_mappings = config_item["enumMappingMap"]
     status_value = None
     if str(dp_value) in enum_mappings and "value" in enum_mappings[str(dp_value)]:
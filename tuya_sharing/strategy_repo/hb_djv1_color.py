@@ -1,12 +1,12 @@
-import json
 import colorsys
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("hb_djv1_color")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -24,7 +24,7 @@ def convert_value(json_str):
 
 
 def colorStrToHsvVOJson(color_str):
-    color_dict = json.loads(color_str)
+    color_dict = codec.loads(color_str)
     h = float(color_dict["h"]) / 360
     s = float(color_dict["s"]) / 255
     v = float(color_dict["v"]) / 255
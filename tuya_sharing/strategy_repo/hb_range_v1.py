@@ -1,11 +1,11 @@
-import json
 from .. import strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("hb_range_v1")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, ""
 
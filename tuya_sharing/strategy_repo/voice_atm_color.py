@@ -1,13 +1,13 @@
 import colorsys
-import json
 
-from .. import strategy
+from .. import codec, strategy
+from ..strategy import get_status_key
 
 
 @strategy.register("voice_atm_color")
 def convert(dp_item: tuple, config_item: dict = None) -> tuple:
     dp_key, dp_value = dp_item
-    status_key, _ = json.loads(config_item["statusFormat"]).popitem()
+    status_key = get_status_key(config_item)
     if dp_value is None:
         return status_key, dp_value
 
@@ -52,7 +52,7 @@ def convert_value(str_colour_value):
             v=round(hsv_map["V"] * 255, 1)
         )
 
-        return json.dumps(hsv_vo.__dict__)
+        return codec.dumps(hsv_vo.__dict__)
 
     vo = get_hsv_from_color_dp_value(str_colour_value)
 
@@ -62,7 +62,7 @@ def convert_value(str_colour_value):
         v=round(vo.brightness * 255, 1)
     )
 
-    return json.dumps(hsv_vo.__dict__)
+    return codec.dumps(hsv_vo.__dict__)
 
 def rgb2hsv_standard(red, green, blue):
     hsv = colorsys.rgb_to_hsv(red / 255, green / 255, blue / 255)